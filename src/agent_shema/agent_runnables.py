@@ -6,14 +6,14 @@ from agent_shema.build_assistants import (  # type: ignore
 )
 from agent_shema.build_system_prompts import AgentPrompts  # type: ignore
 from agent_shema.complete_or_escalate import CompleteOrEscalate  # type: ignore
-from src.load_config import LoadConfig
+from src.load_config import get_config
 from src.tools.bottle_neck import calculate_bottleneck
 from src.tools.game_runner import game_run_tool
 from src.tools.regard_parser import regard_parser_tool
 from src.tools.sql_agent_tools import pc_builder_tool, question_answer_tool
 
 AGENT_PROMPTS = AgentPrompts()
-CFG = LoadConfig()
+CFG = get_config()
 
 
 class AIAgentRunnables:
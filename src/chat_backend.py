@@ -3,10 +3,10 @@ import uuid
 from typing import Any
 
 from src.agent_shema.mult_agents_graph import AgenticGraph
-from src.load_config import LoadConfig
+from src.load_config import get_config
 from src.utils.utilities import _print_event
 
-CFG = LoadConfig()
+CFG = get_config()
 db = CFG.local_file
 
 db_exists = os.path.exists(db)
@@ -1,4 +1,6 @@
 import os
+from functools import lru_cache
+from typing import Any
 
 import yaml
 from dotenv import load_dotenv
@@ -7,14 +9,26 @@ from pyprojroot import here
 
 load_dotenv()
 
-with open(here("configs/config.yml")) as cfg:
-    app_config = yaml.load(cfg, Loader=yaml.FullLoader)
+# C-реализация загрузчика (libyaml), если PyYAML собран с ней
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+@lru_cache(maxsize=1)
+def load_app_config() -> dict[str, Any]:
+    """Читает configs/config.yml один раз за процесс и возвращает разобранный словарь."""
+    with open(here("configs/config.yml")) as cfg:
+        return yaml.load(cfg, Loader=YAML_LOADER)  # type: ignore
+
+
+app_config = load_app_config()
 
 
 class LoadConfig:
     def __init__(self) -> None:
         # Databases directories
         self.local_file = here(app_config["directories"]["local_file"])
+        # Кэш ответов LLM (SQLite) для детерминированных вызовов инструментов
+        self.llm_cache = here(app_config["directories"]["llm_cache"])
         api_key: str | None = os.getenv("OPEN_AI_API_KEY")
         if api_key is not None:
             os.environ["OPENAI_API_KEY"] = api_key
@@ -28,3 +42,9 @@ class LoadConfig:
 
         os.environ["LANGCHAIN_TRACING_V2"] = str(app_config["langsmith"]["tracing"])
         os.environ["LANGCHAIN_PROJECT"] = str(app_config["langsmith"]["project_name"])
+
+
+@lru_cache(maxsize=1)
+def get_config() -> LoadConfig:
+    """Возвращает общий для всех модулей экземпляр LoadConfig (и его LLM-клиент)."""
+    return LoadConfig()
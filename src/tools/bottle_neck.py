@@ -2,12 +2,12 @@ from typing import Any
 
 from langchain.tools import tool
 from pydantic import BaseModel
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
+from rapidfuzz import fuzz, process, utils
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as ec
 from selenium.webdriver.support.ui import WebDriverWait
-from thefuzz import process  # type: ignore
+
+from src.utils.webdriver_pool import WAIT_TIMEOUT, borrow_driver
 
 
 # Модели для входных и выходных данных
@@ -38,6 +38,31 @@ class BottleneckResponse(BaseModel):
     results: Results
 
 
+# Скрипт, собирающий все результаты расчёта со страницы за один запрос к браузеру
+RESULTS_SCRIPT = """
+const nodes = (xpath, context) => {
+    const snapshot = document.evaluate(
+        xpath, context || document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null
+    );
+    return Array.from({length: snapshot.snapshotLength}, (_, i) => snapshot.snapshotItem(i));
+};
+const text = (xpath, context) => {
+    const node = nodes(xpath, context)[0];
+    return node ? node.innerText.trim() : "";
+};
+return {
+    cpu_performance: text("//span[text()='CPU Performance']/following-sibling::span"),
+    gpu_performance: text("//span[text()='GPU Performance']/following-sibling::span"),
+    bottleneck_percentage: text("//h3[text()='Bottleneck Percentage']/following-sibling::p"),
+    scenarios: nodes("//div[contains(@class, 'flex flex-col items-center text-center')]")
+        .map((scenario) => [text(".//h6", scenario), text(".//p", scenario)]),
+    recommendations: nodes("//p[contains(text(), 'limiting')]")
+        .concat(nodes("//ul[@class='list-disc list-inside space-y-2 text-gray-700 ml-0']//li"))
+        .map((node) => node.innerText.trim()),
+};
+"""
+
+
 # Функция для расчета узкого горлышка между процессором и видеокартой
 @tool
 def calculate_bottleneck(input_json: dict[str, Any]) -> dict[str, Any]:
@@ -67,21 +92,16 @@ def calculate_bottleneck(input_json: dict[str, Any]) -> dict[str, Any]:
     except Exception as e:
         return {"error": str(e)}
 
-    chrome_options = Options()
-    chrome_options.add_argument("--headless")
-    chrome_options.add_argument("--disable-gpu")
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument("--disable-dev-shm-usage")
+    # Берём браузер из пула вместо запуска нового Chrome на каждый вызов
+    with borrow_driver() as driver:
+        wait = WebDriverWait(driver, WAIT_TIMEOUT)
+        driver.get("https://bottleneckcalculator.help/")
 
-    # Запуск драйвера
-    driver = webdriver.Chrome(options=chrome_options)
-    wait = WebDriverWait(driver, 20)
-    driver.get("https://bottleneckcalculator.help/")
-
-    try:
         # Функция для поиска наиболее похожего элемента из списка
         def get_best_match(input_text, elements_list):
-            best_match = process.extractOne(input_text, elements_list)
+            best_match = process.extractOne(
+                input_text, elements_list, scorer=fuzz.WRatio, processor=utils.default_process
+            )
             return best_match[0] if best_match else ""
 
         # 1. Заполнение поля для процессора
@@ -94,8 +114,9 @@ def calculate_bottleneck(input_json: dict[str, Any]) -> dict[str, Any]:
                 ec.presence_of_all_elements_located((By.XPATH, "//div[@class='p-2']//span"))
             )
         ]
+        best_processor_match = get_best_match(processor, processor_list)
         processor_input.clear()
-        processor_input.send_keys(get_best_match(processor, processor_list))
+        processor_input.send_keys(best_processor_match)
 
         # 2. Заполнение поля для GPU
         gpu_input = wait.until(ec.presence_of_element_located((By.ID, "graphics")))
@@ -107,8 +128,9 @@ def calculate_bottleneck(input_json: dict[str, Any]) -> dict[str, Any]:
                 ec.presence_of_all_elements_located((By.XPATH, "//div[@class='p-2']//span"))
             )
         ]
+        best_gpu_match = get_best_match(gpu, gpu_list)
         gpu_input.clear()
-        gpu_input.send_keys(get_best_match(gpu, gpu_list))
+        gpu_input.send_keys(best_gpu_match)
 
         try:
             calculate_button = wait.until(
@@ -119,55 +141,36 @@ def calculate_bottleneck(input_json: dict[str, Any]) -> dict[str, Any]:
         except Exception:
             driver.execute_script("arguments[0].click();", calculate_button)
 
-        # Извлечение информации
-        cpu_performance = wait.until(
-            ec.presence_of_element_located(
-                (By.XPATH, "//span[text()='CPU Performance']/following-sibling::span")
-            )
-        ).text
-        gpu_performance = wait.until(
-            ec.presence_of_element_located(
-                (By.XPATH, "//span[text()='GPU Performance']/following-sibling::span")
-            )
-        ).text
-        bottleneck_percentage = wait.until(
+        # Извлечение информации: ждём появления результата и забираем все поля
+        # одним вызовом execute_script вместо отдельного запроса к браузеру на каждый элемент
+        wait.until(
             ec.presence_of_element_located(
                 (By.XPATH, "//h3[text()='Bottleneck Percentage']/following-sibling::p")
             )
-        ).text
+        )
+        page_data = driver.execute_script(RESULTS_SCRIPT)
+
+        cpu_performance = page_data["cpu_performance"]
+        gpu_performance = page_data["gpu_performance"]
+        bottleneck_percentage = page_data["bottleneck_percentage"]
 
         # 4. Получение производительности в разных сценариях
         performance_scenarios = {
-            scenario.find_element(By.XPATH, ".//h6")
-            .text: scenario.find_element(By.XPATH, ".//p")
-            .text
-            for scenario in driver.find_elements(
-                By.XPATH, "//div[contains(@class, 'flex flex-col items-center text-center')]"
-            )
-            if scenario.find_element(By.XPATH, ".//h6").text
-            in ["Gaming", "Content Creation", "Streaming"]
+            title: value
+            for title, value in page_data["scenarios"]
+            if title in ["Gaming", "Content Creation", "Streaming"]
         }
 
-        # 5. Парсим екомендации
-        recommendations = []
-
-        # Собираем все возможные рекомендации
-        performance_recommendations = driver.find_elements(
-            By.XPATH, "//p[contains(text(), 'limiting')]"
-        )
-        recommendations.extend([rec.text for rec in performance_recommendations])
-        other_recommendations = driver.find_elements(
-            By.XPATH, "//ul[@class='list-disc list-inside space-y-2 text-gray-700 ml-0']//li"
-        )
-        recommendations.extend([rec.text for rec in other_recommendations])
+        # 5. Парсим рекомендации
+        recommendations = page_data["recommendations"]
 
         # Формирование ответа с использованием Pydantic
         input_params = InputParameters(
             cpu=processor,
             gpu=gpu,
             resolution=resolution,
-            best_processor_match=get_best_match(processor, processor_list),
-            best_gpu_match=get_best_match(gpu, gpu_list),
+            best_processor_match=best_processor_match,
+            best_gpu_match=best_gpu_match,
         )
 
         performance_scenarios_data = PerformanceScenarios(
@@ -189,10 +192,6 @@ def calculate_bottleneck(input_json: dict[str, Any]) -> dict[str, Any]:
         # Возвращаем результаты в формате JSON
         return bottleneck_response.model_dump()
 
-    finally:
-        # Закрытие браузера
-        driver.quit()
-
 
 # # Пример вызова функции
 # if __name__ == "__main__":
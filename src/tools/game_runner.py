@@ -1,182 +1,260 @@
-import time
-from typing import Any
+import copy
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import Any, TypedDict
 
 from langchain.tools import tool
-from pydantic import BaseModel
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
+from rapidfuzz import fuzz, process, utils
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
+from selenium.webdriver.remote.webdriver import WebDriver
+from selenium.webdriver.remote.webelement import WebElement
 from selenium.webdriver.support import expected_conditions as ec
 from selenium.webdriver.support.ui import WebDriverWait
-from thefuzz import process  # type: ignore
 
+from src.utils.webdriver_pool import WAIT_TIMEOUT, borrow_driver
 
-# Основная модель для результата
-class GameRequirementsResult(BaseModel):
+
+# Схемы описаны через TypedDict: результат собирается обычным словарём,
+# без валидации Pydantic и model_dump на каждом вызове (в том числе при попадании в кэш)
+class GameRequirementsResult(TypedDict):
     game: str
     cpu: str
     gpu: str
     ram: int
-    requirements: str | None = None
+    requirements: str | None
     fps_info: list[dict[str, str]]
     paragraphs: list[str]
-    error: str | None = None
+    error: str | None
 
 
-class InputData(BaseModel):
+class InputData(TypedDict, total=False):
     game_name: str | None
     cpu: str | None
     gpu: str | None
-    ram: int | None = None
+    ram: int | None
 
 
-def check_game_requirements(game_name, cpu, gpu, ram) -> dict[str, Any]:
-    """
-    Проверка совместимости системных требований для игры.
+def validate_input_data(input_data: dict[str, Any]) -> InputData:
     """
-    chrome_options = Options()
-    chrome_options.add_argument("--headless")
-    chrome_options.add_argument("--disable-gpu")
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument("--disable-dev-shm-usage")
+    Проверяет входные данные game_run_tool и приводит ram к int.
 
-    driver = webdriver.Chrome(options=chrome_options)
-    wait = WebDriverWait(driver, 20)
+    Поле memory принимается как синоним ram и, как и раньше, имеет приоритет над ним.
+    ram может быть целым числом, целым float (16.0) или строкой с целым числом ("16");
+    bool и дробные значения отклоняются. При ошибке выбрасывает ValueError.
+    """
+    for field in ("game_name", "cpu", "gpu"):
+        if field not in input_data:
+            raise ValueError(f"{field}: field required")
+        value = input_data[field]
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f"{field}: expected a string, got {type(value).__name__}")
+
+    ram = input_data["memory"] if "memory" in input_data else input_data.get("ram")
+    if isinstance(ram, str) and ram.strip().lstrip("+-").isdigit():
+        ram = int(ram)
+    elif isinstance(ram, float) and ram.is_integer():
+        ram = int(ram)
+    if ram is not None and (isinstance(ram, bool) or not isinstance(ram, int)):
+        raise ValueError(f"ram: expected an integer, got {ram!r}")
+    return {
+        "game_name": input_data["game_name"],
+        "cpu": input_data["cpu"],
+        "gpu": input_data["gpu"],
+        "ram": ram,
+    }
+
+
+# Локаторы страницы technical.city, общие для всех вызовов
+GAME_NAME_INPUT = (By.CSS_SELECTOR, "input.ui-autocomplete-input")
+AUTOCOMPLETE_LIST = (
+    By.CSS_SELECTOR,
+    "ul.ui-menu.ui-widget.ui-widget-content.ui-autocomplete.highlight.ui-front",
+)
+AUTOCOMPLETE_GAME_ITEMS = (By.CSS_SELECTOR, "span.bold-text")
+CPU_INPUT = (By.CSS_SELECTOR, "input.select-input[placeholder='Выберите процессор']")
+GPU_INPUT = (By.CSS_SELECTOR, "input.select-input[placeholder='Выберите видеокарту']")
+AUTOCOMPLETE_ITEMS = (By.CSS_SELECTOR, f"{AUTOCOMPLETE_LIST[1]} li.ui-menu-item")
+RAM_DROPDOWN = (By.CSS_SELECTOR, "span.selecter-selected")
+# Объём памяти приводится к int, поэтому значение атрибута не требует экранирования
+RAM_OPTION_TEMPLATE = 'span.selecter-item[data-value="{ram}"]'
+FPS_ELEMENTS = (By.CSS_SELECTOR, "div.fps_value em")
+FPS_VALUES_LOCATOR = (
+    By.XPATH,
+    "//div[@class='fps_value']/em[@class='green' or @class='yellow' or @class='red']",
+)
+
+# Скрипт, собирающий требования, абзацы и значения FPS со страницы за один запрос к браузеру
+RESULTS_SCRIPT = """
+const texts = (xpath) => {
+    const snapshot = document.evaluate(
+        xpath, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null
+    );
+    return Array.from(
+        {length: snapshot.snapshotLength}, (_, i) => snapshot.snapshotItem(i).innerText.trim()
+    );
+};
+return {
+    notice: texts("//p[@class='notice']")[0] || null,
+    paragraphs: texts("(//p)[3] | (//p)[6]"),
+    resolutions: texts("//div[@class='fps_quality_resolution']"),
+    fps: texts(
+        "//div[@class='fps_value']/em[@class='green' or @class='yellow' or @class='red']"
+    ),
+};
+"""
+
+# LRU-кэш успешных результатов: (игра, cpu, gpu, ram) -> результат
+GAME_CACHE_SIZE = 256
+_game_cache: OrderedDict[tuple[Any, ...], GameRequirementsResult] = OrderedDict()
+_game_cache_lock = threading.Lock()
+
+
+def find_game_item(game_name: str) -> Callable[[WebDriver], WebElement | bool]:
+    """
+    Условие для WebDriverWait: видимый пункт автодополнения с точным названием игры.
 
-    try:
-        driver.get("https://technical.city/ru/can-i-run-it")
+    Название сравнивается в Python, а не подставляется в XPath, поэтому кавычки
+    в названии игры не ломают селектор.
+    """
 
-        game_name_input = wait.until(
-            ec.element_to_be_clickable((By.CSS_SELECTOR, "input.ui-autocomplete-input"))
-        )
+    def condition(driver: WebDriver) -> WebElement | bool:
+        for item in driver.find_elements(*AUTOCOMPLETE_GAME_ITEMS):
+            if item.text.strip() == game_name and item.is_displayed() and item.is_enabled():
+                return item
+        return False
 
-        game_name_input.send_keys(game_name)
+    return condition
 
-        wait.until(
-            ec.visibility_of_element_located(
-                (
-                    By.CSS_SELECTOR,
-                    "ul.ui-menu.ui-widget.ui-widget-content.ui-autocomplete.highlight.ui-front",
-                )
-            )
-        )
 
-        game_item = wait.until(
-            ec.element_to_be_clickable(
-                (By.XPATH, f"//span[@class='bold-text' and text()='{game_name}']")
-            )
-        )
+def check_game_requirements(game_name, cpu, gpu, ram) -> GameRequirementsResult:
+    """
+    Проверка совместимости системных требований для игры.
+    """
+    # Берём браузер из пула вместо запуска нового Chrome на каждый вызов
+    with borrow_driver() as driver:
+        wait = WebDriverWait(driver, WAIT_TIMEOUT)
 
-        game_item.click()
+        try:
+            driver.get("https://technical.city/ru/can-i-run-it")
 
-        cpu_input = wait.until(
-            ec.element_to_be_clickable(
-                (By.CSS_SELECTOR, "input.select-input[placeholder='Выберите процессор']")
-            )
-        )
-        cpu_input.send_keys(cpu)
+            game_name_input = wait.until(ec.element_to_be_clickable(GAME_NAME_INPUT))
 
-        gpu_input = wait.until(
-            ec.element_to_be_clickable(
-                (By.CSS_SELECTOR, "input.select-input[placeholder='Выберите видеокарту']")
-            )
-        )
-        gpu_input.send_keys(gpu)
-        gpu_list = wait.until(
-            ec.presence_of_all_elements_located(
-                (
-                    By.CSS_SELECTOR,
-                    "ul.ui-menu.ui-widget.ui-widget-content.ui-autocomplete.highlight.ui-front li.ui-menu-item",
-                )
-            )
-        )
-        gpu_options = [gpu.text for gpu in gpu_list]
-        best_match = process.extractOne(gpu, gpu_options)
-        best_match_element = gpu_list[gpu_options.index(best_match[0])]
-        best_match_element.click()
-
-        ram_dropdown = wait.until(
-            ec.element_to_be_clickable((By.XPATH, "//span[@class='selecter-selected']"))
-        )
-        ram_dropdown.click()
-        ram_option = wait.until(
-            ec.element_to_be_clickable(
-                (By.XPATH, f"//span[@class='selecter-item' and @data-value='{ram}']")
-            )
-        )
-        ram_option.click()
+            game_name_input.send_keys(game_name)
 
-        time.sleep(2)
+            wait.until(ec.visibility_of_element_located(AUTOCOMPLETE_LIST))
 
-        driver.execute_script("window.scrollTo(0, 0);")
-        time.sleep(2)
+            game_item = wait.until(find_game_item(game_name))
 
-        requirements_notice = wait.until(
-            ec.presence_of_all_elements_located((By.XPATH, "//p[@class='notice']"))
-        )
-        requirements_text = requirements_notice[0].text if requirements_notice else None
+            game_item.click()
 
-        paragraph_elements = wait.until(ec.presence_of_all_elements_located((By.XPATH, "//p")))
+            cpu_input = wait.until(ec.element_to_be_clickable(CPU_INPUT))
+            cpu_input.send_keys(cpu)
 
-        resolution_elements = wait.until(
-            ec.presence_of_all_elements_located(
-                (By.XPATH, "//div[@class='fps_quality_resolution']")
+            gpu_input = wait.until(ec.element_to_be_clickable(GPU_INPUT))
+            gpu_input.send_keys(gpu)
+            gpu_list = wait.until(ec.presence_of_all_elements_located(AUTOCOMPLETE_ITEMS))
+            gpu_options = [gpu.text for gpu in gpu_list]
+            # extractOne возвращает (вариант, оценка, индекс) — индекс сразу указывает на элемент
+            best_gpu_match, _, best_match_index = process.extractOne(
+                gpu, gpu_options, scorer=fuzz.WRatio, processor=utils.default_process
             )
-        )
-        fps_elements = wait.until(
-            ec.presence_of_all_elements_located(
-                (
-                    By.XPATH,
-                    "//div[@class='fps_value']/em[@class='green' or @class='yellow' or @class='red']",
+            gpu_list[best_match_index].click()
+
+            ram_dropdown = wait.until(ec.element_to_be_clickable(RAM_DROPDOWN))
+            ram_dropdown.click()
+            ram_option = wait.until(
+                ec.element_to_be_clickable(
+                    (By.CSS_SELECTOR, RAM_OPTION_TEMPLATE.format(ram=int(ram)))
                 )
             )
-        )
-
-        fps_data = []
-        for i in range(min(len(resolution_elements), len(fps_elements))):
-            fps_data.append(
-                {
-                    "resolution": resolution_elements[i].text.strip(),
-                    "fps": fps_elements[i].text.strip(),
-                }
-            )
+            # Запоминаем текущие значения FPS, чтобы дождаться их пересчёта после выбора памяти
+            previous_fps = driver.find_elements(*FPS_ELEMENTS)
+            ram_option.click()
+
+            if previous_fps:
+                try:
+                    WebDriverWait(driver, 2).until(ec.staleness_of(previous_fps[0]))
+                except TimeoutException:
+                    # Значения обновились на месте (или не изменились) — ждать дальше нечего
+                    pass
+
+            driver.execute_script("window.scrollTo(0, 0);")
+
+            # Ждём появления значений FPS и забираем все данные страницы
+            # одним вызовом execute_script вместо отдельного запроса к браузеру на каждый элемент
+            wait.until(ec.presence_of_all_elements_located(FPS_VALUES_LOCATOR))
+            page_data = driver.execute_script(RESULTS_SCRIPT)
+
+            requirements_text = page_data["notice"]
+
+            fps_data = [
+                {"resolution": resolution, "fps": fps}
+                for resolution, fps in zip(page_data["resolutions"], page_data["fps"], strict=False)
+            ]
+
+            # Скрипт возвращает только 3-й и 6-й абзацы страницы
+            paragraphs = page_data["paragraphs"]
+            if len(paragraphs) != 2:
+                raise ValueError("На странице не найдены абзацы с описанием результата")
+
+            return {
+                "game": game_name,
+                "cpu": cpu,
+                "gpu": str(best_gpu_match),
+                "ram": ram,
+                "requirements": requirements_text if requirements_text else "No requirements found",
+                "fps_info": fps_data,
+                "paragraphs": paragraphs,
+                "error": None,
+            }
+
+        except Exception as e:
+            # Указываем все обязательные поля, даже если они None или пустые списки
+            return {
+                "game": game_name,
+                "cpu": cpu,
+                "gpu": gpu,
+                "ram": ram,
+                "requirements": None,
+                "fps_info": [],
+                "paragraphs": [],
+                "error": str(e),
+            }
+
+
+def cached_check_game_requirements(game_name, cpu, gpu, ram) -> GameRequirementsResult:
+    """
+    Обёртка над check_game_requirements с LRU-кэшем по (игра, cpu, gpu, ram).
 
-        paragraphs = [paragraph_elements[i].text for i in [2, 5]]
-
-        # Создаем результат и конвертируем в JSON
-        result = GameRequirementsResult(
-            game=game_name,
-            cpu=cpu,
-            gpu=best_match[0],
-            ram=ram,
-            requirements=requirements_text if requirements_text else "No requirements found",
-            fps_info=fps_data,
-            paragraphs=paragraphs,
-        )
-
-        # Возвращаем результат в виде словаря, преобразуем в JSON
-        return result.model_dump()
-
-    except Exception as e:
-        # Указываем все обязательные поля, даже если они None или пустые списки
-        result = GameRequirementsResult(
-            game=game_name,
-            cpu=cpu,
-            gpu=gpu,
-            ram=ram,
-            requirements=None,
-            fps_info=[],
-            paragraphs=[],
-            error=str(e),
-        )
-        return result.model_dump()
-
-    finally:
-        driver.quit()
+    Результаты с ошибкой не кэшируются. Вызывающему всегда возвращается копия.
+    Название игры входит в ключ как есть: find_game_item сравнивает его точно, поэтому
+    "cyberpunk 2077" и "Cyberpunk 2077" дают разный результат. cpu и gpu сайт подбирает
+    через автодополнение (gpu ещё и нечётко), для них регистр и пробелы по краям не важны.
+    """
+    key = (
+        game_name,
+        *(value.strip().lower() if isinstance(value, str) else value for value in (cpu, gpu)),
+        ram,
+    )
+    with _game_cache_lock:
+        if key in _game_cache:
+            _game_cache.move_to_end(key)
+            return copy.deepcopy(_game_cache[key])
+
+    result = check_game_requirements(game_name, cpu, gpu, ram)
+
+    if result.get("error") is None:
+        with _game_cache_lock:
+            _game_cache[key] = copy.deepcopy(result)
+            if len(_game_cache) > GAME_CACHE_SIZE:
+                _game_cache.popitem(last=False)
+    return result
 
 
 @tool
-def game_run_tool(input_data: dict) -> dict[str, Any]:
+def game_run_tool(input_data: dict) -> GameRequirementsResult | dict[str, str]:
     """
     Проверяет совместимость системных требований игры с заданными компонентами (процессор, видеокарта, оперативная память).
     Пример входных данных dict:
@@ -189,22 +267,17 @@ def game_run_tool(input_data: dict) -> dict[str, Any]:
         }
     """
 
-    if "memory" in input_data:
-        memory = input_data["memory"]
-        input_data["ram"] = memory
-        del input_data["memory"]
-
     try:
-        validated_input = InputData.model_validate(input_data)
-    except Exception as e:
+        validated_input = validate_input_data(input_data)
+    except ValueError as e:
         return {"error": f"Invalid input data: {str(e)}"}
 
-    game_name = validated_input.game_name
-    cpu = validated_input.cpu
-    gpu = validated_input.gpu
-    ram = validated_input.ram
+    game_name = validated_input["game_name"]
+    cpu = validated_input["cpu"]
+    gpu = validated_input["gpu"]
+    ram = validated_input["ram"]
 
-    result = check_game_requirements(game_name, cpu, gpu, ram)
+    result = cached_check_game_requirements(game_name, cpu, gpu, ram)
 
     # Возвращаем как словарь
     return result
@@ -1,11 +1,22 @@
+import asyncio
+import atexit
 import json
+import os
+import tempfile
+import threading
 import time
 import urllib.parse
+from collections import OrderedDict
 from typing import Annotated, Any
 
+import httpx
+from bs4 import BeautifulSoup
 from langchain.tools import tool
-from playwright.sync_api import sync_playwright
+from playwright.async_api import Browser, BrowserContext, Page, Route, async_playwright
 from pydantic import BaseModel, Field
+from pyprojroot import here
+
+from src.load_config import app_config
 
 
 class CPU(BaseModel):
@@ -38,6 +49,40 @@ class Motherboard(BaseModel):
 
 Component = CPU | GPU | Memory | Corpus | PowerSupply | Motherboard
 
+# Сколько компонентов парсится одновременно (по отдельной вкладке браузера на каждый)
+MAX_PARALLEL_COMPONENTS = 4
+
+# Кэш выдачи по поисковому запросу; цены меняются, поэтому записи живут ограниченное время.
+# Записи упорядочены по времени добавления, число записей ограничено
+SEARCH_CACHE_TTL = 3600
+SEARCH_CACHE_SIZE = 2048
+_search_cache: OrderedDict[str, tuple[float, list[dict[str, Any]]]] = OrderedDict()
+
+# Типы ресурсов, которые не нужны для парсинга выдачи. Стили не блокируем:
+# от них зависит innerText, по которому читаются карточки
+BLOCKED_RESOURCE_TYPES = {"image", "font", "media"}
+
+# Селекторы карточки товара в выдаче regard.ru
+TITLE_SELECTOR = ".CardText_title__7bSbO.CardText_listing__6mqXC"
+LINK_SELECTOR = ".CardText_link__C_fPZ"
+PRICE_SELECTOR = ".CardPrice_price__YFA2m .Price_price__m2aSe"
+
+HTTP_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+    ),
+    "Accept-Language": "ru-RU,ru;q=0.9",
+}
+HTTP_TIMEOUT = 10.0
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=40)
+
+# Файл с cookies и localStorage regard.ru, переживающий перезапуск браузера. Лежит в каталоге
+# приложения рядом с кэшем LLM, а не в общем /tmp, куда может записать любой пользователь
+STORAGE_STATE_PATH = str(here(app_config["directories"]["regard_state"]))
+# Таймаут по умолчанию для ожиданий Playwright (миллисекунды)
+BROWSER_TIMEOUT_MS = 8000
+
 
 class ComponentInput(BaseModel):
     components: Annotated[
@@ -58,50 +103,373 @@ class RegardInput(BaseModel):
         return cls(input_data=ComponentInput(**input_data))
 
 
-def parse_first_product(page) -> dict[str, Any] | None:
-    """Извлекает данные о первом товаре."""
+# Скрипт, собирающий карточки товаров со страницы выдачи за один запрос к браузеру.
+# Для каждого заголовка поднимаемся к ближайшему предку, содержащему ссылку и цену,
+# но не выходим за пределы карточки (предок с несколькими заголовками — уже список).
+PRODUCTS_SCRIPT = """
+({title, link, price}) => Array.from(document.querySelectorAll(title)).map((titleNode) => {
+    let card = titleNode.parentElement;
+    while (card && card.querySelectorAll(title).length === 1) {
+        if (card.querySelector(link) && card.querySelector(price)) break;
+        card = card.parentElement;
+    }
+    if (!card || card.querySelectorAll(title).length !== 1) card = null;
+    const linkNode = card ? card.querySelector(link) : titleNode.closest(link);
+    const priceNode = card ? card.querySelector(price) : null;
+    return {
+        name: titleNode.innerText,
+        price: priceNode ? priceNode.innerText : null,
+        href: linkNode ? linkNode.getAttribute("href") : null,
+    };
+})
+"""
+
+
+def parse_price(price_text: str | None) -> float | None:
+    """Преобразует текст цены вида '12 345 ₽' в число."""
+    if not price_text:
+        return None
     try:
-        page.wait_for_selector(".CardText_link__C_fPZ", timeout=15000)
+        return float(price_text.replace("\xa0", "").replace("₽", "").replace(" ", "").strip())
+    except ValueError:
+        return None
 
-        name_element = page.query_selector(".CardText_title__7bSbO.CardText_listing__6mqXC")
-        name = name_element.inner_text() if name_element else "Название не найдено"
 
-        price_element = page.query_selector(".CardPrice_price__YFA2m .Price_price__m2aSe")
-        price = (
-            float(price_element.inner_text().replace("\xa0", "").replace("₽", "").strip())
-            if price_element
-            else "Цена не найдена"
+async def parse_all_products(page: Page) -> list[dict[str, Any]]:
+    """Извлекает все товары со страницы выдачи в порядке отображения."""
+    try:
+        await page.wait_for_selector(LINK_SELECTOR, timeout=15000)
+        cards = await page.evaluate(
+            PRODUCTS_SCRIPT,
+            {
+                "title": TITLE_SELECTOR,
+                "link": LINK_SELECTOR,
+                "price": PRICE_SELECTOR,
+            },
         )
+    except Exception as e:
+        print(f"Ошибка парсинга товаров: {str(e)}")
+        return []
+
+    return normalize_cards(cards)
+
 
-        link_element = page.query_selector(".CardText_link__C_fPZ")
-        link = (
-            "https://www.regard.ru" + (link_element.get_attribute("href")) if link_element else "#"
+def normalize_cards(cards: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Приводит сырые карточки (name/price/href) к итоговому виду товара."""
+    return [
+        {
+            "name": card["name"] or "Название не найдено",
+            "price": parse_price(card["price"]),
+            "link": "https://www.regard.ru" + card["href"] if card["href"] else "#",
+        }
+        for card in cards
+    ]
+
+
+def parse_products_html(html: str) -> list[dict[str, Any]]:
+    """
+    Извлекает товары из HTML выдачи, отданного сервером, тем же способом, что и PRODUCTS_SCRIPT.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    cards = []
+    for title_node in soup.select(TITLE_SELECTOR):
+        card = title_node.parent
+        while card is not None and len(card.select(TITLE_SELECTOR)) == 1:
+            if card.select_one(LINK_SELECTOR) and card.select_one(PRICE_SELECTOR):
+                break
+            card = card.parent
+        if card is not None and len(card.select(TITLE_SELECTOR)) != 1:
+            card = None
+
+        if card is not None:
+            link_node = card.select_one(LINK_SELECTOR)
+            price_node = card.select_one(PRICE_SELECTOR)
+        else:
+            link_node = title_node.css.closest(LINK_SELECTOR)
+            price_node = None
+
+        cards.append(
+            {
+                "name": title_node.get_text(strip=True),
+                "price": price_node.get_text(strip=True) if price_node else None,
+                "href": link_node.get("href") if link_node else None,
+            }
+        )
+    return normalize_cards(cards)
+
+
+# Фоновый event loop, в котором выполняются все вызовы инструмента. Он живёт столько же,
+# сколько процесс, поэтому HTTP-клиент и его соединения переиспользуются между вызовами
+# (asyncio.run на каждый вызов создавал бы новый loop и новые соединения)
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_lock = threading.Lock()
+_http_client: httpx.AsyncClient | None = None
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Возвращает фоновый event loop, при первом вызове запуская его в отдельном потоке."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="regard-parser", daemon=True).start()
+        return _loop
+
+
+def run_in_event_loop(coro: Any) -> Any:
+    """Выполняет корутину в фоновом event loop и дожидается результата."""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Возвращает общий HTTP/2-клиент с пулом соединений (вызывать внутри фонового loop)."""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            http2=True,
+            headers=HTTP_HEADERS,
+            timeout=HTTP_TIMEOUT,
+            limits=HTTP_LIMITS,
+            follow_redirects=True,
         )
+    return _http_client
+
+
+@atexit.register
+def close_http_client() -> None:
+    """Закрывает HTTP-клиент и останавливает фоновый event loop при завершении процесса."""
+    if _loop is None:
+        return
+    if _http_client is not None:
+        try:
+            run_in_event_loop(_http_client.aclose())
+        except Exception as e:
+            print(f"Ошибка закрытия HTTP-клиента: {str(e)}")
+    _loop.call_soon_threadsafe(_loop.stop)
+
+
+def get_search_url(search_query: str) -> str:
+    """Возвращает адрес страницы поиска regard.ru."""
+    return f"https://www.regard.ru/catalog?search={urllib.parse.quote_plus(search_query)}"
 
-        return {"name": name, "price": price, "link": link}
-    except Exception as e:
-        print(f"Ошибка парсинга товара: {str(e)}")
-        return None
 
+async def fetch_component(
+    client: httpx.AsyncClient, component_type_key: str, search_query: str
+) -> list[dict[str, Any]]:
+    """
+    Получает выдачу по компоненту обычным HTTP-запросом, без браузера.
 
-def apply_sorting(page, sort_text: str) -> dict[str, Any] | None:
-    """Применяет сортировку и извлекает первый товар."""
+    Возвращает пустой список, если сервер не отдал карточки в HTML (например, выдача
+    отрисовывается только на клиенте) — тогда компонент парсится через Playwright.
+    """
+    print(f"🔍 Обработка компонента {component_type_key} по HTTP: {search_query}")
     try:
-        print(f"\nПрименяем сортировку: {sort_text}")
+        response = await client.get(get_search_url(search_query))
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        print(f"Ошибка HTTP-запроса для {search_query}: {str(e)}")
+        return []
+    return select_products(parse_products_html(response.text))
+
+
+def select_products(products: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """
+    Выбирает самый дешёвый, самый дорогой и самый популярный товар из одной выдачи.
+
+    Вместо трёх пересортировок страницы сортируем уже загруженные товары на стороне Python;
+    популярность определяется порядком выдачи.
+    """
+    priced = [product for product in products if product["price"] is not None]
+    selected = []
+    if priced:
+        selected.append(("Сначала с низкой ценой", min(priced, key=lambda p: p["price"])))
+        selected.append(("Сначала дорогие", max(priced, key=lambda p: p["price"])))
+    if products:
+        selected.append(("Сначала популярные", products[0]))
+
+    return [
+        {
+            "sort_type": sort_type,
+            "name": product["name"],
+            "price": product["price"] if product["price"] is not None else "Цена не найдена",
+            "link": product["link"],
+        }
+        for sort_type, product in selected
+    ]
 
-        sort_button = page.wait_for_selector(".SelectableList_wrap__uvkMK")
-        sort_button.click()
 
-        option = page.wait_for_selector(f"//span[text()='{sort_text}']")
-        option.click()
+def get_search_query(component_model: Component) -> tuple[str | None, str | None]:
+    """Определяет тип компонента и извлекает значение для поиска."""
+    if isinstance(component_model, CPU):
+        return component_model.cpu, "cpu"
+    if isinstance(component_model, GPU):
+        return component_model.gpu, "gpu"
+    if isinstance(component_model, Memory | Corpus | PowerSupply | Motherboard):
+        # Используем имя класса модели напрямую для ключа
+        return component_model.name, type(component_model).__name__.lower()
+    return None, None
+
+
+async def block_unneeded_resources(route: Route) -> None:
+    """Отменяет загрузку картинок, шрифтов и медиа, остальные запросы пропускает."""
+    if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+async def parse_component(
+    context: BrowserContext,
+    semaphore: asyncio.Semaphore,
+    component_type_key: str,
+    search_query: str,
+) -> list[dict[str, Any]]:
+    """
+    Парсит выдачу по одному компоненту на отдельной вкладке общего контекста браузера.
+
+    Если страница не загрузилась, возвращает пустой список, как и parse_all_products.
+    """
+    async with semaphore:
+        print(f"🔍 Обработка компонента {component_type_key}: {search_query}")
+
+        page = await context.new_page()
+        try:
+            search_url = get_search_url(search_query)
+            print(f"Открываем страницу: {search_url}")
+            await page.goto(search_url, wait_until="domcontentloaded")
+
+            return select_products(await parse_all_products(page))
+        except Exception as e:
+            # Ошибка одного компонента (например, таймаут загрузки) не должна отменять
+            # результаты остальных, собираемых в том же asyncio.gather
+            print(f"Ошибка загрузки страницы для {search_query}: {str(e)}")
+            return []
+        finally:
+            await page.close()
 
-        page.wait_for_selector(".CardText_link__C_fPZ")
-        time.sleep(2)
 
-        return parse_first_product(page)
-    except Exception as e:
-        print(f"Ошибка при сортировке: {str(e)}")
-        return None
+def get_cached_search(search_query: str) -> list[dict[str, Any]] | None:
+    """Возвращает выдачу из кэша, если запись ещё не устарела."""
+    cached = _search_cache.get(search_query)
+    if cached and time.monotonic() - cached[0] < SEARCH_CACHE_TTL:
+        return cached[1]
+    return None
+
+
+def cache_search(search_query: str, result: list[dict[str, Any]]) -> None:
+    """Сохраняет выдачу в кэш и удаляет устаревшие и самые старые записи сверх лимита."""
+    now = time.monotonic()
+    _search_cache[search_query] = (now, result)
+    _search_cache.move_to_end(search_query)
+    # Самые старые записи в начале: удаляем, пока они устарели или кэш переполнен
+    while _search_cache:
+        oldest_time, _ = next(iter(_search_cache.values()))
+        if now - oldest_time < SEARCH_CACHE_TTL and len(_search_cache) <= SEARCH_CACHE_SIZE:
+            break
+        _search_cache.popitem(last=False)
+
+
+async def new_browser_context(browser: Browser) -> BrowserContext:
+    """
+    Создаёт контекст браузера с cookies, сохранёнными с прошлого запуска.
+
+    Если файла нет или он повреждён, создаётся чистый контекст.
+    """
+    if os.path.exists(STORAGE_STATE_PATH):
+        try:
+            return await browser.new_context(storage_state=STORAGE_STATE_PATH)
+        except Exception as e:
+            print(f"Не удалось загрузить состояние браузера: {str(e)}")
+    return await browser.new_context()
+
+
+def save_storage_state(state: dict[str, Any]) -> None:
+    """
+    Атомарно сохраняет состояние браузера: пишет во временный файл и подменяет им старый,
+    чтобы параллельный запуск или сбой не оставил файл записанным наполовину.
+    """
+    directory = os.path.dirname(STORAGE_STATE_PATH)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".regard_state.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as tmp_file:
+            json.dump(state, tmp_file)
+        os.replace(tmp_path, STORAGE_STATE_PATH)
+    except OSError as e:
+        print(f"Не удалось сохранить состояние браузера: {str(e)}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+async def parse_components(components: list[Component]) -> dict[str, list[dict[str, Any]]]:
+    """
+    Параллельно парсит все компоненты: по HTTP, а то, что не удалось, — в одном
+    headless-браузере.
+    """
+    # Поисковый запрос -> тип компонента. Одинаковые запросы (например, два одинаковых
+    # процессора) парсятся один раз: ответ всё равно собирается по поисковому запросу
+    queries: dict[str, str] = {}
+    for component_model in components:
+        search_query, component_type_key = get_search_query(component_model)
+        if not search_query or not component_type_key:
+            print(f"Не удалось определить поисковый запрос для компонента: {component_model}")
+            continue
+        queries.setdefault(search_query, component_type_key)
+
+    results: dict[str, list[dict[str, Any]]] = {}
+    to_fetch = []
+    for search_query, component_type_key in queries.items():
+        cached = get_cached_search(search_query)
+        if cached is not None:
+            print(f"Берём из кэша: {search_query}")
+            results[search_query] = cached
+        else:
+            to_fetch.append((search_query, component_type_key))
+
+    if to_fetch:
+        # Сначала пробуем получить выдачу по HTTP — это на порядки быстрее запуска браузера
+        client = get_http_client()
+        http_results = await asyncio.gather(
+            *(
+                fetch_component(client, component_type_key, search_query)
+                for search_query, component_type_key in to_fetch
+            )
+        )
+        for (search_query, _), result in zip(to_fetch, http_results, strict=True):
+            if result:
+                cache_search(search_query, result)
+                results[search_query] = result
+        to_fetch = [item for item in to_fetch if item[0] not in results]
+
+    if to_fetch:
+        semaphore = asyncio.Semaphore(MAX_PARALLEL_COMPONENTS)
+        async with async_playwright() as p:
+            browser = await p.chromium.launch(
+                headless=True, args=["--disable-dev-shm-usage", "--no-sandbox"]
+            )
+            try:
+                # Один контекст на все компоненты: общий кэш DNS/TLS/HTTP и cookies,
+                # сохранённые с прошлого запуска
+                context = await new_browser_context(browser)
+                context.set_default_timeout(BROWSER_TIMEOUT_MS)
+                await context.route("**/*", block_unneeded_resources)
+
+                component_results = await asyncio.gather(
+                    *(
+                        parse_component(context, semaphore, component_type_key, search_query)
+                        for search_query, component_type_key in to_fetch
+                    )
+                )
+                save_storage_state(dict(await context.storage_state()))
+            finally:
+                await browser.close()
+
+        for (search_query, _), result in zip(to_fetch, component_results, strict=True):
+            if result:
+                cache_search(search_query, result)
+            results[search_query] = result
+
+    # Сохраняем порядок компонентов из запроса
+    return {search_query: results[search_query] for search_query in queries}
 
 
 @tool(args_schema=RegardInput)
@@ -119,63 +487,7 @@ def regard_parser_tool(input_data: dict[str, Any]) -> str:
 
     print(f"Компоненты для анализа: {components_to_parse}")
 
-    results = {}
-
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=False)
-        page = browser.new_page()
-        try:
-            for component_model in components_to_parse:  # Имя переменной изменено для ясности
-                search_query = None
-                component_type_key = None
-
-                # Определяем тип компонента и извлекаем значение для поиска
-                if isinstance(component_model, CPU):
-                    search_query = component_model.cpu
-                    component_type_key = "cpu"
-                elif isinstance(component_model, GPU):
-                    search_query = component_model.gpu
-                    component_type_key = "gpu"
-                elif isinstance(component_model, Memory | Corpus | PowerSupply | Motherboard):
-                    search_query = component_model.name
-                    # Используем имя класса модели напрямую для ключа
-                    component_type_key = type(component_model).__name__.lower()
-
-                if not search_query:
-                    print(
-                        f"Не удалось определить поисковый запрос для компонента: {component_model}"
-                    )
-                    continue
-
-                print(f"🔍 Обработка компонента {component_type_key}: {search_query}")
-
-                encoded_query = urllib.parse.quote_plus(search_query)
-                search_url = f"https://www.regard.ru/catalog?search={encoded_query}"
-                print(f"Открываем страницу: {search_url}")
-                page.goto(search_url, wait_until="domcontentloaded")
-
-                sort_options = ["Сначала с низкой ценой", "Сначала дорогие", "Сначала популярные"]
-
-                component_results = []
-                for sort_type in sort_options:
-                    try:
-                        product_info = apply_sorting(page, sort_type)
-                        if product_info:
-                            component_results.append(
-                                {
-                                    "sort_type": sort_type,
-                                    "name": product_info["name"],
-                                    "price": product_info["price"],
-                                    "link": product_info["link"],
-                                }
-                            )
-                        time.sleep(2)
-                    except Exception as e:
-                        print(f"Ошибка при обработке {sort_type}: {str(e)}")
-                        continue
-                results[search_query] = component_results
-        finally:
-            browser.close()
+    results = run_in_event_loop(parse_components(components_to_parse))
 
     return json.dumps(results, ensure_ascii=False, indent=2)
 
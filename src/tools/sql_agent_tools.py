@@ -1,11 +1,17 @@
 import json
 import os
+import re
+import threading
+from collections import OrderedDict
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import Any, Literal
 
-from langchain.chains import create_sql_query_chain
 from langchain.schema import HumanMessage, SystemMessage
 from langchain.sql_database import SQLDatabase
 from langchain_community.agent_toolkits import SQLDatabaseToolkit
+from langchain_community.cache import SQLiteCache
 from langchain_community.tools import (
     InfoSQLDatabaseTool,
     ListSQLDatabaseTool,
@@ -14,21 +20,97 @@ from langchain_community.tools import (
 )
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
 from langchain_core.tools import tool
 from langchain_openai import ChatOpenAI
 from pydantic import BaseModel, Field, SecretStr, ValidationError, field_validator
-from pyprojroot import here
-from sqlalchemy import create_engine, text
+from sqlalchemy import URL, Engine, create_engine, event, text
+from sqlalchemy.pool import QueuePool
 
-from src.load_config import LoadConfig
+from src.load_config import get_config
 
-CFG = LoadConfig()
-db_path = str(here("")) + "\\pc_accessories_2.db"
-db_path = f"sqlite:///{db_path}"
+CFG = get_config()
+# Путь к базе берётся из configs/config.yml (directories.local_file) и не зависит от ОС
+DB_URL = URL.create("sqlite", database=str(CFG.local_file))
 
-engine = create_engine(db_path)
-db = SQLDatabase(engine)
+# Блок кода ```sql ... ```, в который LLM иногда оборачивает запрос
+SQL_FENCE_RE = re.compile(r"^```(?:sql)?\s*([\s\S]+?)\s*```$", re.IGNORECASE)
+
+# Блок кода ```json ... ``` в ответе LLM
+JSON_FENCE_RE = re.compile(r"```(?:json)?\s*(\{[\s\S]+?\})\s*```", re.IGNORECASE)
+
+# LIMIT в конце запроса (с необязательным OFFSET и точкой с запятой)
+TRAILING_LIMIT_RE = re.compile(
+    r"\blimit\s+\d+(?:\s*(?:offset\s+|,\s*)\d+)?\s*;?\s*$", re.IGNORECASE
+)
+
+# Комментарий в конце запроса: строчный (-- ...) или блочный (/* ... */)
+TRAILING_COMMENT_RE = re.compile(r"(?:--[^\n]*|/\*(?:(?!\*/).)*\*/)$", re.DOTALL)
+
+# Ключевые слова типа сборки -> нормализованный тип (порядок задаёт приоритет)
+BUILD_TYPE_KEYWORDS = {
+    "игр": "игровая",
+    "гейм": "игровая",
+    "стрим": "игровая",
+    "монтаж": "игровая",
+    "рендер": "игровая",
+    "офис": "офисная",
+    "работ": "офисная",
+    "программ": "офисная",
+    "веб": "офисная",
+}
+BUILD_TYPE_RE = re.compile("|".join(map(re.escape, BUILD_TYPE_KEYWORDS)))
+
+# Бюджет: число (допускаются пробелы между разрядами) и необязательный множитель "к"/"тыс"
+BUDGET_RE = re.compile(r"(?<![\w.,])(\d{1,3}(?:\s\d{3})+|\d+)\s*(?:(к|k|тыс[а-я]*)(?!\w))?(?!\d)")
+MIN_BUDGET = 10_000
+MAX_BUDGET = 10_000_000
+# Слова, которые могут остаться в простом запросе помимо бюджета и типа сборки.
+# Любое другое слово (модель, бренд, объём памяти) — повод отдать запрос LLM
+SIMPLE_REQUEST_WORDS = frozenset(
+    "пк pc компьютер компьютера комп компа сборка сборку сборки собери соберите собрать "
+    "подбери подберите подобрать нужен нужна нужно хочу мне за до в на с со для и "
+    "примерно около не дороже бюджет бюджетом руб рублей рубля р".split()
+)
+WORD_RE = re.compile(r"\w+")
+
+
+# Настройки SQLite для каждого нового соединения пула: кэш страниц 64 МБ,
+# временные таблицы в памяти и чтение файла базы через mmap (256 МБ)
+SQLITE_PRAGMAS = (
+    "PRAGMA cache_size=-65536",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+)
+
+
+def set_sqlite_pragmas(dbapi_connection: Any, _connection_record: Any) -> None:
+    """Применяет SQLITE_PRAGMAS к соединению один раз при его создании."""
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
+
+@lru_cache(maxsize=1)
+def get_engine() -> Engine:
+    """
+    Возвращает общий engine с пулом соединений.
+
+    Соединения переиспользуются между вызовами инструментов; check_same_thread=False
+    позволяет брать их из разных потоков (Gradio обрабатывает запросы в пуле потоков).
+    """
+    engine = create_engine(
+        DB_URL,
+        poolclass=QueuePool,
+        pool_size=8,
+        max_overflow=16,
+        pool_pre_ping=True,
+        connect_args={"check_same_thread": False},
+    )
+    event.listen(engine, "connect", set_sqlite_pragmas)
+    return engine
 
 
 class SQLAgentRequest(BaseModel):
@@ -39,7 +121,74 @@ class SQLAgentRequest(BaseModel):
     table_info: str | None = Field(None, description="Информация о таблицах базы данных")
 
 
-# ------------------- Класс SQLAgent с цепочкой Runnables  -------------------
+# Промпты не зависят от запроса, поэтому собираются один раз при импорте модуля
+FINAL_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            "You are a MySQL expert. Given an input question, create a syntactically correct MySQL query "
+            "to run with {top_k} examples (use LIMIT {top_k}). Unless otherwise specified.\n\n"
+            "Here is the relevant table info: {table_info}\n\n"
+            "**Key Rules:**\n"
+            "For abstract/fuzzy requests (e.g. 'найти что-то связанное с X', 'показать всё похожее на Y'):\n"
+            "   - Use `LIKE '%value%'` for text searches\n"
+            "   - Return all matches when no specific filters provided\n\n"
+            "Below are a number of examples of questions and their corresponding SQL queries.",
+        ),
+        ("human", "{input}"),
+    ]
+)
+
+ANSWER_PROMPT = ChatPromptTemplate.from_template(
+    "Вопрос пользователя: {user_question}\n\n"
+    "Ответ SQL-агента (JSON): {sql_response}\n\n"
+    "Перефразируй этот SQL-ответ, чтобы он звучал естественно для пользователя."
+)
+REPHRASE_CHAIN = ANSWER_PROMPT | CFG.llm | StrOutputParser()
+
+
+# Инструменты SQLDatabaseToolkit, которые использует SQLAgent
+SQL_TOOL_TYPES = (
+    QuerySQLDatabaseTool,
+    InfoSQLDatabaseTool,
+    ListSQLDatabaseTool,
+    QuerySQLCheckerTool,
+)
+
+
+def strip_trailing_comments(query: str) -> str:
+    """
+    Убирает комментарии (-- ... и /* ... */) в конце запроса.
+
+    Комментарий не трогается, если перед ним незакрытая кавычка: тогда это часть строки.
+    """
+    query = query.rstrip()
+    while True:
+        match = TRAILING_COMMENT_RE.search(query)
+        if not match or query[: match.start()].count("'") % 2:
+            return query
+        query = query[: match.start()].rstrip()
+
+
+def ensure_limit(query: str, max_rows: int) -> str:
+    """Добавляет LIMIT в конец запроса, если LLM его не указала."""
+    query = strip_trailing_comments(query)
+    if TRAILING_LIMIT_RE.search(query):
+        return query
+    return f"{query.rstrip(';').rstrip()} LIMIT {max_rows}"
+
+
+def is_sql_syntax_error(error: Exception) -> bool:
+    """Проверяет, что SQLite отверг запрос из-за синтаксиса, а не из-за схемы или данных."""
+    message = str(error).lower()
+    return (
+        "syntax error" in message
+        or "incomplete input" in message
+        or "unrecognized token" in message
+    )
+
+
+# ------------------- Класс SQLAgent -------------------
 class SQLAgent:
     def __init__(self, engine, llm: ChatOpenAI | None = None):
         """
@@ -54,166 +203,295 @@ class SQLAgent:
           - QuerySQLCheckerTool (требует llm)
         """
         self.engine = engine
-        self.llm = CFG.llm or ChatOpenAI(model="gpt-4o-mini")
+        self.llm = llm or CFG.llm or ChatOpenAI(model="gpt-4o-mini")
         # , base_url="https://api.vsegpt.ru/v1"
         # Инициализируем объект базы через LangChain SQLDatabase
         self.db = SQLDatabase(engine)
 
-        # Создаём необходимые инструменты, передавая db
-        self.toolkit = SQLDatabaseToolkit(db=self.db, llm=self.llm)
+        # Исправление запроса после ошибки идёт мимо кэша LLM: кэш по тому же промпту
+        # вернул бы тот же неудачный запрос на каждой повторной попытке
+        self.uncached_llm = self.llm.model_copy(update={"cache": False})
+
+        # Создаём необходимые инструменты, передавая db (checker_tool работает только при ошибках)
+        self.toolkit = SQLDatabaseToolkit(db=self.db, llm=self.uncached_llm)
         self.tools = self.toolkit.get_tools()
 
-        # Извлекаем нужные инструменты
-        self.query_tool = next(
-            tool for tool in self.tools if isinstance(tool, QuerySQLDatabaseTool)
+        # Извлекаем нужные инструменты за один проход по списку. isinstance, а не точное
+        # совпадение типа: тулкит может вернуть подкласс (например, устаревший алиас)
+        tools_by_type: dict[type, Any] = {}
+        for sql_tool in self.tools:
+            for tool_type in SQL_TOOL_TYPES:
+                if isinstance(sql_tool, tool_type):
+                    tools_by_type.setdefault(tool_type, sql_tool)
+        self.query_tool = tools_by_type[QuerySQLDatabaseTool]
+        self.info_tool = tools_by_type[InfoSQLDatabaseTool]
+        self.list_tool = tools_by_type[ListSQLDatabaseTool]
+        self.checker_tool = tools_by_type[QuerySQLCheckerTool]
+
+        self.final_prompt = FINAL_PROMPT
+
+        # Цепочка собрана вручную, а не через create_sql_query_chain: та на каждом вызове
+        # заново читает схему и примеры строк всех таблиц, игнорируя переданный table_info
+        self.generate_query = (
+            self.final_prompt | self.llm.bind(stop=["\nSQLResult:"]) | StrOutputParser()
         )
-        self.info_tool = next(tool for tool in self.tools if isinstance(tool, InfoSQLDatabaseTool))
-        self.list_tool = next(tool for tool in self.tools if isinstance(tool, ListSQLDatabaseTool))
-        self.checker_tool = next(
-            tool for tool in self.tools if isinstance(tool, QuerySQLCheckerTool)
+        self.regenerate_query = (
+            self.final_prompt | self.uncached_llm.bind(stop=["\nSQLResult:"]) | StrOutputParser()
         )
 
-        self.final_prompt = ChatPromptTemplate.from_messages(
-            [
-                (
-                    "system",
-                    "You are a MySQL expert. Given an input question, create a syntactically correct MySQL query "
-                    "to run with {top_k} examples (use LIMIT {top_k}). Unless otherwise specified.\n\n"
-                    "Here is the relevant table info: {table_info}\n\n"
-                    "**Key Rules:**\n"
-                    "For abstract/fuzzy requests (e.g. 'найти что-то связанное с X', 'показать всё похожее на Y'):\n"
-                    "   - Use `LIKE '%value%'` for text searches\n"
-                    "   - Return all matches when no specific filters provided\n\n"
-                    "Below are a number of examples of questions and their corresponding SQL queries.",
-                ),
-                ("human", "{input}"),
-            ]
-        )
+        # Схема базы не меняется во время работы, поэтому описание таблиц получаем один раз
+        self.table_info = self.db.get_table_info()
 
-        self.generate_query = create_sql_query_chain(self.llm, self.db, self.final_prompt)
+    def _generation_input(
+        self, question: str, top_k: int, table_info: str | None = None
+    ) -> dict[str, Any]:
+        """Готовит переменные FINAL_PROMPT для генерации SQL-запроса по вопросу."""
+        return {
+            "input": question + "\nSQLQuery: ",
+            "top_k": top_k,
+            "table_info": table_info or self.table_info,
+        }
 
-        # Собираем runnable-цепочку через assign:
-        self.chain = (
-            RunnablePassthrough.assign(
-                query=lambda inp: self.generate_query.invoke(inp),
-                question=lambda inp: inp["question"],
-                top_k=lambda inp: inp["top_k"],
+    def _invoke(self, input_dict: dict[str, Any], max_rows: int | None = None) -> dict[str, Any]:
+        """
+        Генерирует SQL-запрос по вопросу, очищает его и выполняет с повторными попытками.
+
+        Шаги вызываются напрямую, без цепочки RunnablePassthrough.assign: она копировала
+        словарь и оборачивала каждую лямбду в Runnable на каждом шаге.
+        """
+        query = self.clean_sql_query(
+            self.generate_query.invoke(
+                self._generation_input(
+                    input_dict["question"], input_dict["top_k"], input_dict.get("table_info")
+                )
             )
-            .assign(query=lambda x: self.clean_sql_query(x["query"]))
-            .assign(result=lambda x: self.execute_query_with_retry(x["query"], x["question"]))
         )
+        result, executed_query = self.execute_query_with_retry(
+            query, input_dict["question"], max_rows=max_rows
+        )
+        return {**input_dict, "query": executed_query, "result": result}
+
+    def refresh_schema(self) -> None:
+        """Перечитывает описание таблиц, если схема базы изменилась."""
+        self.table_info = self.db.get_table_info()
 
     @staticmethod
     def clean_sql_query(query: str) -> str:
         query = query.strip()
-        import re
-
-        pattern = r"^```(?:sql)?\s*([\s\S]+?)\s*```$"
-        match = re.search(pattern, query, flags=re.IGNORECASE)
+        match = SQL_FENCE_RE.search(query)
         if match:
             return match.group(1).strip()
         # Если не найден блок кода, удаляем все маркеры "```" (на случай, если они остались)
         query = query.replace("```", "")
         return query.strip()
 
-    def query_to_json(self, query: str) -> list:
+    def query_to_json(self, query: str, params: dict[str, Any] | None = None) -> list:
         """
         Выполняет SQL-запрос через engine и возвращает результат в виде списка словарей.
+        params подставляются в именованные параметры запроса (:budget и т.п.).
         """
         with self.engine.connect() as conn:
-            result = conn.execute(text(query))
-            rows = [dict(row._mapping) for row in result]
+            result = conn.execute(text(query), params or {})
+            rows = [dict(row) for row in result.mappings()]
         return rows
 
-    def execute_query_with_retry(self, query: str, question: str, max_retries: int = 3) -> list:
+    def execute_query_with_retry(
+        self, query: str, question: str, max_retries: int = 3, max_rows: int | None = None
+    ) -> tuple[list, str]:
         """
         Выполняет SQL-запрос с повторными попытками.
         При неудаче переписывает запрос через генерацию нового с помощью checker_tool/info_tool.
-        Возвращает результат выполнения запроса в виде списка словарей.
+        Возвращает результат (список словарей) и запрос, который в итоге был выполнен.
         """
         for attempt in range(max_retries):
+            if max_rows is not None:
+                query = ensure_limit(query, max_rows)
             try:
-                _ = self.query_tool.run(query)
-                return self.query_to_json(query)
+                print(f"Выполняем SQL-запрос (попытка {attempt + 1}):\n{query}")
+                return self.query_to_json(query), query
             except Exception as e:
                 print(f"Попытка {attempt + 1} завершилась ошибкой: {e}")
                 if attempt < max_retries - 1:
-                    query = self.validate_sql_query(query, question)
+                    query = self.validate_sql_query(query, question, error=e)
                     print(f"Переписываем запрос: {query}")
                 else:
                     raise e
-        return []
+        return [], query
 
-    def validate_sql_query(self, query: str, question: str) -> str:
+    def validate_sql_query(self, query: str, question: str, error: Exception | None = None) -> str:
         """
         Проверяет корректность SQL-запроса через checker_tool.
         Если проверка не проходит, генерирует новый запрос с помощью info_tool и генератора запроса.
+
+        Если запрос синтаксически корректен, а ошибка смысловая (например, нет такой колонки),
+        checker_tool не поможет — сразу генерируем новый запрос по схеме, без лишнего вызова LLM.
         """
-        try:
-            # Очищаем запрос перед валидацией
-            clean_query = self.clean_sql_query(query)
-            validated_query = self.checker_tool.run(clean_query)
-
-            # Дополнительная очистка результата
-            return self.clean_sql_query(validated_query)
-
-        except Exception as e:
-            print(f"Проверка запроса не удалась: {e}")
-            table_info = self.info_tool.run("Get all table and column information")
-            new_query = self.generate_query.invoke(
-                {"question": question, "table_info": table_info, "top_k": 1}
+        if error is None or is_sql_syntax_error(error):
+            try:
+                # Очищаем запрос перед валидацией
+                clean_query = self.clean_sql_query(query)
+                validated_query = self.checker_tool.run(clean_query)
+
+                # Дополнительная очистка результата
+                return self.clean_sql_query(validated_query)
+
+            except Exception as e:
+                print(f"Проверка запроса не удалась: {e}")
+        else:
+            print("Запрос синтаксически корректен, генерируем новый по схеме базы")
+
+        # Неудачный запрос и ошибку передаём модели, чтобы она не сгенерировала его снова
+        if error is not None:
+            question = (
+                f"{question}\n\nПредыдущий запрос завершился ошибкой, не повторяй его:\n"
+                f"{query}\nОшибка: {getattr(error, 'orig', error)}"
             )
+        new_query = self.regenerate_query.invoke(self._generation_input(question, 1))
 
         # Принудительная очистка сгенерированного запроса
         return self.clean_sql_query(str(new_query))
 
-    def run(self, request: SQLAgentRequest) -> dict[str, Any]:
+    def run(self, request: SQLAgentRequest, max_rows: int | None = None) -> dict[str, Any]:
         """
-        Основной метод SQL-агента, реализованный через цепочку Runnables.
+        Основной метод SQL-агента.
         Принимает запрос (SQLAgentRequest) и возвращает результат в виде словаря.
+        Если задан max_rows, запрос без LIMIT в конце ограничивается этим числом строк.
         """
         if isinstance(request, dict):
             if "table_info" not in request:
-                request["table_info"] = self.info_tool.run("Get all table and column information")
+                request["table_info"] = self.table_info
             input_dict = request
         else:
             input_dict = request.model_dump()
             if input_dict.get("table_info") is None:
-                input_dict["table_info"] = self.info_tool.run(
-                    "Get all table and column information"
-                )
+                input_dict["table_info"] = self.table_info
 
-        output = self.chain.invoke(input_dict)
-        return output  # type: ignore
+        return self._invoke(input_dict, max_rows=max_rows)
 
 
-def parse_user_request(user_input: str) -> str:
-    """Парсит пользовательский запрос в структурированный JSON с валидацией"""
+@lru_cache(maxsize=1)
+def get_llm_cache() -> SQLiteCache:
+    """
+    Возвращает общий кэш ответов LLM для разбора запросов и генерации SQL.
 
-    # Pydantic модель внутри функции
-    class BuildRequest(BaseModel):
-        budget: int
-        build_type: Literal["игровая", "офисная"]
-        additional_info: dict[str, str] = {}
-
-        @field_validator("build_type")
-        def normalize_build_type(self, v):
-            build_mapping = {
-                "игр": "игровая",
-                "гейм": "игровая",
-                "стрим": "игровая",
-                "монтаж": "игровая",
-                "рендер": "игровая",
-                "офис": "офисная",
-                "работ": "офисная",
-                "программ": "офисная",
-                "веб": "офисная",
-            }
-            lower_v = v.lower()
-            return next((val for key, val in build_mapping.items() if key in lower_v), "офисная")
+    Кэш точный (по полному тексту промпта) и хранится в SQLite, поэтому повторные
+    одинаковые запросы не обращаются к API и после перезапуска приложения. Кэш подключается
+    только к этим моделям, а не глобально: ответы чат-ассистента не кэшируются.
+    """
+    return SQLiteCache(database_path=str(CFG.llm_cache))
+
+
+@lru_cache(maxsize=1)
+def get_sql_agent() -> SQLAgent:
+    """
+    Возвращает общий SQL-агент: инструменты, промпт и цепочка создаются один раз,
+    а не на каждый вопрос пользователя.
+    """
+    return SQLAgent(get_engine(), llm=CFG.llm.model_copy(update={"cache": get_llm_cache()}))
+
+
+@lru_cache(maxsize=1)
+def get_parser_llm() -> ChatOpenAI:
+    """Возвращает общий клиент LLM для разбора запросов на сборку."""
+    openai_api_key_str = os.getenv("OPEN_AI_API_KEY")
+    if not openai_api_key_str:
+        raise ValueError("API ключ не найден в переменных окружения")
+    # JSON mode: модель возвращает только JSON-объект без пояснений вокруг него
+    return ChatOpenAI(
+        api_key=SecretStr(openai_api_key_str),
+        model="gpt-4o-mini",
+        cache=get_llm_cache(),
+        model_kwargs={"response_format": {"type": "json_object"}},
+    )
+
+
+def find_budget(lower_input: str) -> tuple[int, re.Match[str]] | None:
+    """Находит бюджет в рублях и его фрагмент в запросе в нижнем регистре."""
+    for match in BUDGET_RE.finditer(lower_input):
+        budget = int(re.sub(r"\s", "", match.group(1)))
+        if match.group(2):
+            budget *= 1000
+        if MIN_BUDGET <= budget <= MAX_BUDGET:
+            return budget, match
+    return None
+
+
+def extract_budget(lower_input: str) -> int | None:
+    """Извлекает бюджет в рублях из запроса в нижнем регистре ("150к", "80 тыс", "120 000")."""
+    found = find_budget(lower_input)
+    return found[0] if found else None
+
+
+def parse_simple_request(user_input: str) -> tuple[int, str] | None:
+    """
+    Разбирает запрос без LLM, если в нём есть только бюджет и тип сборки.
+
+    Возвращает (бюджет, тип сборки) или None, если в запросе не удалось однозначно найти
+    бюджет и тип сборки или после них осталось что-то ещё (компоненты, бренды, объёмы):
+    такие запросы разбирает LLM.
+    """
+    lower_input = user_input.lower()
+    found = find_budget(lower_input)
+    hits = set(BUILD_TYPE_RE.findall(lower_input))
+    if found is None or not hits:
+        return None
+
+    budget, match = found
+    rest = lower_input[: match.start()] + " " + lower_input[match.end() :]
+    for word in WORD_RE.findall(rest):
+        if word not in SIMPLE_REQUEST_WORDS and not BUILD_TYPE_RE.match(word):
+            return None
+
+    build_type = next(val for key, val in BUILD_TYPE_KEYWORDS.items() if key in hits)
+    return budget, build_type
+
+
+def extract_json_object(raw_content: str) -> Any:
+    """
+    Достаёт JSON из ответа LLM: сначала весь ответ целиком, затем блок ```json ... ```,
+    затем фрагмент от первой "{" до последней "}".
+
+    Если ни один вариант не разобрался, выбрасывает json.JSONDecodeError.
+    """
+    try:
+        return json.loads(raw_content)
+    except json.JSONDecodeError as e:
+        error = e
+
+    candidates = []
+    fence_match = JSON_FENCE_RE.search(raw_content)
+    if fence_match:
+        candidates.append(fence_match.group(1))
+    first_brace, last_brace = raw_content.find("{"), raw_content.rfind("}")
+    if 0 <= first_brace < last_brace:
+        candidates.append(raw_content[first_brace : last_brace + 1])
+
+    for candidate in candidates:
+        try:
+            return json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+    raise error
 
-    # Исправленный системный промпт с экранированием
-    system_prompt = """Ты ИИ-ассистент для парсинга технических запросов. Строго следуй правилам:
+
+# Модель ответа LLM при разборе запроса на сборку
+class ParsedBuildRequest(BaseModel):
+    budget: int
+    build_type: Literal["игровая", "офисная"]
+    additional_info: dict[str, str] = {}
+
+    # mode="before": приводим ответ LLM ("игровой ПК", "Офисная") к Literal до его проверки
+    @field_validator("build_type", mode="before")
+    @classmethod
+    def normalize_build_type(cls, v):
+        # Один проход регулярным выражением вместо проверки каждого ключевого слова;
+        # приоритет по-прежнему определяется порядком BUILD_TYPE_KEYWORDS
+        hits = set(BUILD_TYPE_RE.findall(str(v).lower()))
+        return next((val for key, val in BUILD_TYPE_KEYWORDS.items() if key in hits), "офисная")
+
+
+# Системный промпт парсера запросов на сборку (передаётся как есть, не как шаблон)
+PARSER_SYSTEM_PROMPT = """Ты ИИ-ассистент для парсинга технических запросов. Строго следуй правилам:
 
         1. **Бюджет**: Число в рублях (200к → 200000)
         2. **Тип сборки** (ТОЛЬКО 2 варианта):
@@ -233,6 +511,7 @@ def parse_user_request(user_input: str) -> str:
         - Синонимы: "корпус" → corpus, "ОЗУ" → memory
         - Если просят производителя, то укажи модель, например: "Intel" → "cpu Nvidia",
         - Но если просят Nvidea, то укажи: "Nvidia" → "gpu Geforce"
+        - Отвечай только JSON-объектом с полями budget, build_type, additional_info
 
         Примеры:
         Запрос: "Игровой ПК до 300к с RTX 4090 и видеопамятью 24 гб, i9-14900K, корпус ATX с количеством слотов 4 штуки"
@@ -272,16 +551,21 @@ def parse_user_request(user_input: str) -> str:
         Текущий запрос: "{input}"
     """
 
-    # Получение ответа от LLM
-    openai_api_key_str = os.getenv("OPEN_AI_API_KEY")
-    if not openai_api_key_str:
-        raise ValueError("API ключ не найден в переменных окружения")
-    openai_api_key = SecretStr(openai_api_key_str)
+
+def parse_user_request(user_input: str) -> str:
+    """Парсит пользовательский запрос в структурированный JSON с валидацией"""
+
+    # Простые запросы ("игровой ПК за 150к") разбираем без обращения к LLM
+    quick_request = parse_simple_request(user_input)
+    if quick_request is not None:
+        budget, build_type = quick_request
+        validated = ParsedBuildRequest(budget=budget, build_type=build_type).model_dump()
+        return json.dumps(validated, ensure_ascii=False)  # type: ignore
 
     # Получение ответа от LLM
-    client = ChatOpenAI(api_key=openai_api_key, model="gpt-4o-mini")
+    client = get_parser_llm()
     response = client.invoke(
-        [SystemMessage(content=system_prompt), HumanMessage(content=user_input)]
+        [SystemMessage(content=PARSER_SYSTEM_PROMPT), HumanMessage(content=user_input)]
     )
 
     try:
@@ -290,15 +574,15 @@ def parse_user_request(user_input: str) -> str:
             raise TypeError(
                 f"Ожидалось, что содержимое ответа LLM будет строкой для JSON-парсинга, получено: {type(raw_content)}"
             )
-        raw_data = json.loads(raw_content)
-        validated = BuildRequest(**raw_data).model_dump()
+        raw_data = extract_json_object(raw_content)
+        validated = ParsedBuildRequest(**raw_data).model_dump()
 
         # Возвращаем строку JSON
         return json.dumps(validated, ensure_ascii=False)  # type: ignore
 
     except (json.JSONDecodeError, ValidationError, TypeError) as e:
         print(f"Ошибка парсинга или валидации: {e}")
-        default_data = BuildRequest(
+        default_data = ParsedBuildRequest(
             budget=50000, build_type="офисная", additional_info={}
         ).model_dump()
         return json.dumps(default_data, ensure_ascii=False)  # type: ignore
@@ -319,22 +603,21 @@ def question_answer_tool(user_input: str) -> str:
     Вход: "Какая цена у Intel Core i9-12900K?"
     Выход: "Цена процессора Intel Core i9-12900K составляет 600 долларов."
     """
-    sql_agent = SQLAgent(engine, llm=CFG.llm)  # Создаем экземпляр SQL-агента
-    request = SQLAgentRequest(
-        question=user_input, top_k=5, table_info=sql_agent.db.get_table_info()
-    )
+    sql_agent = get_sql_agent()
+    request = SQLAgentRequest(question=user_input, top_k=5, table_info=sql_agent.table_info)
 
     sql_response = sql_agent.run(request)
 
-    answer_prompt = ChatPromptTemplate.from_template(
-        "Вопрос пользователя: {user_question}\n\n"
-        "Ответ SQL-агента (JSON): {sql_response}\n\n"
-        "Перефразируй этот SQL-ответ, чтобы он звучал естественно для пользователя."
+    # В промпт передаём готовый JSON только с запросом и строками результата: описание схемы
+    # (table_info) и повтор вопроса LLM для перефразирования не нужны. default=str
+    # сериализует Decimal/datetime из строк базы
+    sql_response_json = json.dumps(
+        {"query": sql_response["query"], "result": sql_response["result"]},
+        ensure_ascii=False,
+        default=str,
     )
-    rephrase_chain = answer_prompt | CFG.llm | StrOutputParser()
-
-    final_answer = rephrase_chain.invoke(
-        {"user_question": user_input, "answer_prompt": answer_prompt, "sql_response": sql_response}
+    final_answer = REPHRASE_CHAIN.invoke(
+        {"user_question": user_input, "sql_response": sql_response_json}
     )
     return final_answer
 
@@ -345,14 +628,22 @@ class BuildRequest(BaseModel):
     additional_info: dict[str, Any] | None = None
 
 
-def calculate_component_budgets(
-    budget: int, build_type: str, components_percentages: dict[str, dict[str, float]]
-) -> dict[str, int]:
+def to_permille(percentages: dict[str, float]) -> dict[str, int]:
+    """Переводит доли бюджета (0.4) в целые промилле (400)."""
+    return {component: round(percentage * 1000) for component, percentage in percentages.items()}
+
+
+def split_budget(budget: int, permille: dict[str, int]) -> dict[str, int]:
     """
-    Распределяет общий бюджет между компонентами в зависимости от типа сборки.
+    Делит бюджет по долям в промилле целочисленной арифметикой, без ошибок округления float.
     """
-    percentages = components_percentages.get(build_type, {})
-    return {component: int(budget * percentage) for component, percentage in percentages.items()}
+    budgets = {component: budget * share // 1000 for component, share in permille.items()}
+    # Остаток от округления вниз отдаём последнему компоненту, чтобы сумма совпадала с бюджетом
+    # (если доли в сумме дают 100%)
+    if budgets and sum(permille.values()) == 1000:
+        last_component = next(reversed(budgets))
+        budgets[last_component] += budget - sum(budgets.values())
+    return budgets
 
 
 # --- Заданные проценты для распределения бюджета ---
@@ -368,192 +659,376 @@ components_percentages = {
     "офисная": {"cpu": 0.4, "memory": 0.3, "motherboard": 0.2, "power_supply": 0.1},
 }
 
+# Те же доли в целых промилле, пересчитанные один раз при импорте
+COMPONENT_BUDGET_PERMILLE = {
+    build_type: to_permille(percentages)
+    for build_type, percentages in components_percentages.items()
+}
+
+
+# Параметры компонента, которые не попадают в "Доп. условия" промпта
+DYNAMIC_CONDITIONS_IGNORE = frozenset({"budget"})
+
+
+# Правило промпта: готовая строка либо кортеж, который DynamicPCBuilderPrompter._render_rule
+# превращает в строку по параметрам компонента и уже выбранным компонентам:
+#   ("param", шаблон, ключ)          — шаблон.format_map(params), если ключ есть в params
+#   ("selected", шаблон, компонент, поле) — шаблон с {value} из выбранного ранее компонента
+#   ("conditions", таблица)          — дополнительные условия из params
+#   ("power",)                       — минимальная мощность блока питания
+PromptRule = str | tuple[str, ...]
+
+BUDGET_RULE: PromptRule = ("param", "Бюджет: <= {budget} руб.", "budget")
+
+# Конфигурация промптов для каждого компонента
+COMPONENT_CONFIG: dict[str, dict[str, Any]] = {
+    "gpu": {
+        "description": "Подбор видеокарты: ",
+        "main_table": "gpu_full_info",
+        "dynamic_rules": [
+            "Таблица: gpu_full_info выбирать только dustinct gpu в запросе",
+            "JOIN gpu_hierarchy ON gpu_hierarchy.gpu = gpu_full_info.gpu",
+            (
+                "param",
+                "Разрешение: {resolution} (проверить в gpu_hierarchy.{resolution} Ultra)",
+                "resolution",
+            ),
+            ("param", "Бюджет: <= {budget} руб. Колонка average_price", "budget"),
+            ("conditions", "gpu_full_info"),
+            "Сортировка: рейтинг (по убыванию), average_price (по убыванию)",
+            "Вывести все поля",
+        ],
+    },
+    "cpu": {
+        "description": "Подбор процессора:",
+        "main_table": "cpu_merged",
+        "dynamic_rules": [
+            "Таблица: cpu_merged",
+            BUDGET_RULE,
+            ("conditions", "cpu_merged"),
+            "Сортировка: рейтинг (по убыванию)",
+            "Вывести все поля",
+        ],
+    },
+    "motherboard": {
+        "description": "Подбор материнской платы:",
+        "main_table": "motherboard",
+        "dynamic_rules": [
+            "Таблица: motherboard",
+            "JOIN socket_compatibility ON socket_compatibility.motherboard_socket = motherboard.socket",
+            ("selected", "Сокет процессора: {value}", "cpu", "socket"),
+            BUDGET_RULE,
+            ("conditions", "motherboard"),
+            "Сортировка: price (по убыванию)",
+            "Вывести все поля",
+        ],
+    },
+    "memory": {
+        "description": "Подбор оперативной памяти:",
+        "main_table": "memory",
+        "dynamic_rules": [
+            "Таблица: memory",
+            ("selected", "Совместимость: <= {value} слотов", "motherboard", "memory_slots"),
+            ("selected", "Макс. объем: <= {value} GB", "motherboard", "max_memory"),
+            BUDGET_RULE,
+            ("conditions", "memory"),
+            "Сортировка: speed_num (по убыванию)",
+            "Вывести все поля",
+        ],
+    },
+    "corpus": {
+        "description": "Подбор корпуса:",
+        "main_table": "corpus",
+        "dynamic_rules": [
+            "Таблица: corpus",
+            "JOIN case_motherboard_compatibility ON corpus.form_factor = case_motherboard_compatibility.case_form_factor",
+            ("selected", "Форм-фактор: {value}", "motherboard", "form_factor"),
+            BUDGET_RULE,
+            ("conditions", "corpus"),
+            "Сортировка: цена (по возрастанию)",
+            "Вывести все поля",
+        ],
+    },
+    "power_supply": {
+        "description": "Подбор блока питания:",
+        "main_table": "'power-supply'",
+        "dynamic_rules": [
+            "Таблица: 'power-supply'",
+            ("power",),
+            BUDGET_RULE,
+            ("conditions", "power-supply"),
+            "Сортировка: цена (по убыванию)",
+            "Вывести все поля",
+        ],
+        "dependencies": ["gpu", "cpu"],
+    },
+}
+
+
+def compile_prompt_segments(config: dict[str, Any]) -> list[PromptRule]:
+    """
+    Склеивает идущие подряд статические строки промпта (описание и правила-строки)
+    в один готовый фрагмент, оставляя динамические правила на своих местах.
+    """
+    segments: list[PromptRule] = []
+    static_lines = [config.get("description", "")]
+    for rule in config.get("dynamic_rules", []):
+        if isinstance(rule, str):
+            static_lines.append(f"• {rule}")
+            continue
+        if static_lines:
+            segments.append("\n".join(static_lines))
+            static_lines = []
+        segments.append(rule)
+    if static_lines:
+        segments.append("\n".join(static_lines))
+    return segments
+
+
+# Заранее склеенные фрагменты промпта для каждого компонента
+PROMPT_SEGMENTS = {
+    component: compile_prompt_segments(config) for component, config in COMPONENT_CONFIG.items()
+}
+
+
+# Этапы подбора компонентов: компоненты одного этапа не зависят друг от друга и подбираются
+# параллельно. Материнской плате нужен сокет процессора, блоку питания — выбранные gpu и cpu,
+# памяти и корпусу — материнская плата
+BUILD_STAGES = (("gpu", "cpu"), ("motherboard", "power_supply"), ("memory", "corpus"))
+# Сколько компонентов одного этапа подбирается одновременно
+MAX_PARALLEL_COMPONENTS = 3
+
+
+@lru_cache(maxsize=128)
+def get_component_budgets(budget: int, build_type: str) -> tuple[tuple[str, int], ...]:
+    """
+    Кэширует распределение бюджета по долям components_percentages (в промилле).
+
+    Возвращает кортеж пар (компонент, бюджет), чтобы закэшированное значение нельзя было изменить.
+    """
+    return tuple(split_budget(budget, COMPONENT_BUDGET_PERMILLE.get(build_type, {})).items())
+
+
+# Кэш SQL-шаблонов: (компонент, промпт без бюджета) -> SQL с параметром :budget.
+# Для повторной сборки с теми же условиями, но другим бюджетом запрос не генерируется LLM заново
+SQL_TEMPLATE_CACHE_SIZE = 256
+_sql_template_cache: OrderedDict[tuple[str, str], str] = OrderedDict()
+_sql_template_cache_lock = threading.Lock()
+# Параметр бюджета в SQL-шаблоне; им же бюджет заменяется в промпте для ключа кэша
+BUDGET_PLACEHOLDER = ":budget"
+
+
+def make_sql_template(query: str, budget: int) -> str | None:
+    """
+    Заменяет литерал бюджета в SQL на параметр :budget.
+
+    Возвращает None, если бюджет встречается в запросе не ровно один раз: тогда нельзя
+    однозначно сказать, какое из чисел — бюджет, и шаблон не сохраняется.
+    """
+    # Число в кавычках не трогаем: параметр внутри строкового литерала не подставится
+    budget_re = re.compile(rf"(?<![\w.:'\"]){budget}(?![\w.'\"])")
+    if len(budget_re.findall(query)) != 1:
+        return None
+    return budget_re.sub(BUDGET_PLACEHOLDER, query)
+
+
+def get_sql_template(key: tuple[str, str]) -> str | None:
+    with _sql_template_cache_lock:
+        template = _sql_template_cache.get(key)
+        if template is not None:
+            _sql_template_cache.move_to_end(key)
+        return template
+
+
+def store_sql_template(key: tuple[str, str], template: str) -> None:
+    with _sql_template_cache_lock:
+        _sql_template_cache[key] = template
+        _sql_template_cache.move_to_end(key)
+        if len(_sql_template_cache) > SQL_TEMPLATE_CACHE_SIZE:
+            _sql_template_cache.popitem(last=False)
+
+
+def drop_sql_template(key: tuple[str, str]) -> None:
+    with _sql_template_cache_lock:
+        _sql_template_cache.pop(key, None)
+
 
 # --- Основной класс для построения промптов ---
 class DynamicPCBuilderPrompter:
     def __init__(self):
         self.selected_components: dict[str, Any] = {}
+        # Суммарная мощность выбранных компонентов, обновляется в _select_component
+        self._power_sum = 0
         # для сборки пк мы последовательно выбираем компоненты, так как необходимо учитывать совместимость
         self.component_order = ["gpu", "cpu", "motherboard", "memory", "corpus", "power_supply"]
-        self.component_config = self._init_config()
+        self.component_config = COMPONENT_CONFIG
+
+    def _render_rule(self, rule: PromptRule, params: dict[str, Any]) -> str | None:
+        """Превращает правило из COMPONENT_CONFIG в строку промпта (None — строка пропускается)."""
+        if isinstance(rule, str):
+            return rule
+        kind = rule[0]
+        if kind == "param":
+            _, template, required_key = rule
+            return template.format_map(params) if required_key in params else None
+        if kind == "selected":
+            _, template, component, field = rule
+            value = self.selected_components.get(component, {}).get(field, "N/A")
+            return template.format(value=value)
+        if kind == "conditions":
+            return self._gen_dynamic_conditions(params, rule[1])
+        if kind == "power":
+            return f"Мин. мощность: {self._calculate_power_consumption()}W"
+        raise ValueError(f"Неизвестное правило промпта: {rule}")
 
-    # Создание промптов с динамическими полями
-    def _init_config(self) -> dict[str, dict]:
-        return {
-            "gpu": {
-                "description": "Подбор видеокарты: ",
-                "main_table": "gpu_full_info",
-                "dynamic_rules": [
-                    lambda p: "Таблица: gpu_full_info выбирать только dustinct gpu в запросе",
-                    lambda p: "JOIN gpu_hierarchy ON gpu_hierarchy.gpu = gpu_full_info.gpu",
-                    lambda p: (
-                        f"Разрешение: {p.get('resolution')} (проверить в gpu_hierarchy.{p.get('resolution', '')} Ultra)"
-                        if "resolution" in p
-                        else None
-                    ),
-                    lambda p: (
-                        f"Бюджет: <= {p['budget']} руб. Колонка average_price"
-                        if "budget" in p
-                        else None
-                    ),
-                    lambda p: self._gen_dynamic_conditions(p, "gpu_full_info"),
-                    "Сортировка: рейтинг (по убыванию), average_price (по убыванию)",
-                    "Вывести все поля",
-                ],
-            },
-            "cpu": {
-                "description": "Подбор процессора:",
-                "main_table": "cpu_merged",
-                "dynamic_rules": [
-                    lambda p: "Таблица: cpu_merged",
-                    lambda p: f"Бюджет: <= {p['budget']} руб." if "budget" in p else None,
-                    lambda p: self._gen_dynamic_conditions(p, "cpu_merged"),
-                    "Сортировка: рейтинг (по убыванию)",
-                    "Вывести все поля",
-                ],
-            },
-            "motherboard": {
-                "description": "Подбор материнской платы:",
-                "main_table": "motherboard",
-                "dynamic_rules": [
-                    lambda p: "Таблица: motherboard",
-                    lambda p: "JOIN socket_compatibility ON socket_compatibility.motherboard_socket = motherboard.socket",
-                    lambda p: f"Сокет процессора: {self.selected_components.get('cpu', {}).get('socket', 'N/A')}",
-                    lambda p: f"Бюджет: <= {p['budget']} руб." if "budget" in p else None,
-                    lambda p: self._gen_dynamic_conditions(p, "motherboard"),
-                    "Сортировка: price (по убыванию)",
-                    "Вывести все поля",
-                ],
-            },
-            "memory": {
-                "description": "Подбор оперативной памяти:",
-                "main_table": "memory",
-                "dynamic_rules": [
-                    lambda p: "Таблица: memory",
-                    lambda p: f"Совместимость: <= {self.selected_components.get('motherboard', {}).get('memory_slots', 'N/A')} слотов",
-                    lambda p: f"Макс. объем: <= {self.selected_components.get('motherboard', {}).get('max_memory', 'N/A')} GB",
-                    lambda p: f"Бюджет: <= {p['budget']} руб." if "budget" in p else None,
-                    lambda p: self._gen_dynamic_conditions(p, "memory"),
-                    "Сортировка: speed_num (по убыванию)",
-                    "Вывести все поля",
-                ],
-            },
-            "corpus": {
-                "description": "Подбор корпуса:",
-                "main_table": "corpus",
-                "dynamic_rules": [
-                    lambda p: "Таблица: corpus",
-                    lambda p: "JOIN case_motherboard_compatibility ON corpus.form_factor = case_motherboard_compatibility.case_form_factor",
-                    lambda p: f"Форм-фактор: {self.selected_components.get('motherboard', {}).get('form_factor', 'N/A')}",
-                    lambda p: f"Бюджет: <= {p['budget']} руб." if "budget" in p else None,
-                    lambda p: self._gen_dynamic_conditions(p, "corpus"),
-                    "Сортировка: цена (по возрастанию)",
-                    "Вывести все поля",
-                ],
-            },
-            "power_supply": {
-                "description": "Подбор блока питания:",
-                "main_table": "'power-supply'",
-                "dynamic_rules": [
-                    lambda p: f"Таблица: {self._table_reference('power_supply')}",
-                    lambda p: f"Мин. мощность: {self._calculate_power_consumption()}W",
-                    lambda p: f"Бюджет: <= {p['budget']} руб." if "budget" in p else None,
-                    lambda p: self._gen_dynamic_conditions(p, "power-supply"),
-                    "Сортировка: цена (по убыванию)",
-                    "Вывести все поля",
-                ],
-                "dependencies": ["gpu", "cpu"],
-            },
-        }
+    @staticmethod
+    def _component_power(comp: Any) -> int:
+        return comp["power"] if isinstance(comp, dict) and "power" in comp else 0
 
-    def _table_reference(self, component: str) -> str:
-        return self.component_config.get(component, {}).get("main_table", component)  # type: ignore
+    def _select_component(self, component: str, comp_info: Any) -> None:
+        """Запоминает выбранный компонент и пересчитывает суммарную мощность без обхода всех."""
+        previous = self.selected_components.get(component)
+        self._power_sum += self._component_power(comp_info) - self._component_power(previous)
+        self.selected_components[component] = comp_info
 
     def _calculate_power_consumption(self) -> int:
-        total_power = 0
-        for comp in self.selected_components.values():
-            if isinstance(comp, dict) and "power" in comp:
-                total_power += comp["power"]
-        return total_power if total_power else 500
+        return self._power_sum or 500
 
     def _gen_dynamic_conditions(self, params: dict, table: str) -> str | None:
-        ignore = {"budget"}
-        conditions = []
-        for key, value in params.items():
-            if key in ignore:
-                continue
-            if isinstance(value, dict):
-                operator = value.get("operator")
-                val = value.get("value")
-                conditions.append(f"{operator} {val}")
-            else:
-                # Если значение строковое — оборачиваем в кавычки
-                if isinstance(value, str):
-                    conditions.append(f"{table}.{key} = '{value}'")
-                else:
-                    conditions.append(f"{table}.{key} = {value}")
-        return "Доп. условия: " + ", ".join(conditions) if conditions else None
+        conditions = ", ".join(
+            self._format_condition(table, key, value)
+            for key, value in params.items()
+            if key not in DYNAMIC_CONDITIONS_IGNORE
+        )
+        return "Доп. условия: " + conditions if conditions else None
 
-    def build_prompts(self, user_request: dict[str, Any]) -> tuple[dict[str, str], dict[str, Any]]:
-        """
-        Для каждого компонента (из списка распределённых по бюджету) формируется промпт.
-        """
-        prompts = {}
-        components = {}
-        req_components = user_request.get("components", {})
-        for component in self.component_order:
-            if component not in req_components:
+    @staticmethod
+    def _format_condition(table: str, key: str, value: Any) -> str:
+        if isinstance(value, dict):
+            return f"{value.get('operator')} {value.get('value')}"
+        # Строковое значение оборачиваем в кавычки, экранируя кавычки внутри по правилам SQL
+        if isinstance(value, str):
+            escaped = value.replace("'", "''")
+            return f"{table}.{key} = '{escaped}'"
+        return f"{table}.{key} = {value}"
+
+    def _render_prompt(self, component: str, params: dict[str, Any]) -> str:
+        """Собирает промпт для компонента из заранее склеенных фрагментов и динамических правил."""
+        return "\n".join(self._iter_prompt_lines(component, params))
+
+    def _iter_prompt_lines(self, component: str, params: dict[str, Any]) -> Iterator[str]:
+        """Отдаёт строки промпта: статичные фрагменты как есть, правила — пунктами «• ...»."""
+        for segment in PROMPT_SEGMENTS.get(component, ()):
+            if isinstance(segment, str):
+                yield segment
                 continue
+            line = self._render_rule(segment, params)
+            if line:
+                yield f"• {line}"
 
-            params = req_components[component]
-            config = self.component_config.get(component, {})
-            prompt_lines = [config.get("description", "")]
-            for rule in config.get("dynamic_rules", []):
-                if callable(rule):
-                    line = rule(params)
-                else:
-                    line = rule
-                if line:
-                    prompt_lines.append(f"• {line}")
-
-            prompt = "\n".join(prompt_lines)
-            prompts[component] = prompt
-            print(prompt)
+    def _select_sql(
+        self, agent: SQLAgent, component: str, prompt: str, params: dict[str, Any]
+    ) -> dict[str, Any]:
+        """
+        Подбирает компонент: сначала по сохранённому SQL-шаблону, иначе через LLM.
 
-            agent = SQLAgent(engine=engine, llm=CFG.llm)
-            response = agent.run(
-                SQLAgentRequest(question=prompt, table_info=db.get_table_info(), top_k=1)
+        Шаблон выполняется с текущим бюджетом; если он не вернул строк или упал,
+        запрос генерируется заново. Удачный запрос LLM сохраняется как шаблон.
+        """
+        budget = params.get("budget")
+        key = None
+        if isinstance(budget, int):
+            key = (
+                component,
+                self._render_prompt(component, {**params, "budget": BUDGET_PLACEHOLDER}),
             )
-            components[component] = response.get("result")
-
-            raw_result = response.get("result", [])
-            if isinstance(raw_result, str):
+            template = get_sql_template(key)
+            if template is not None:
                 try:
-                    result_data = json.loads(raw_result)
+                    print(f"Используем сохранённый SQL-шаблон для {component}")
+                    result = agent.query_to_json(template, {"budget": budget})
                 except Exception as e:
-                    print(f"Ошибка при обработке JSON для компонента {component}: {e}")
-                    result_data = []
-            elif isinstance(raw_result, list):
-                result_data = raw_result
-            else:
+                    print(f"SQL-шаблон для {component} не выполнился: {e}")
+                    drop_sql_template(key)
+                    result = []
+                if result:
+                    return {"question": prompt, "query": template, "result": result}
+
+        # Используется только первая строка результата, поэтому SQLite
+        # может остановиться на ней, даже если LLM не добавила LIMIT
+        response = agent.run(
+            SQLAgentRequest(question=prompt, table_info=agent.table_info, top_k=1), max_rows=1
+        )
+        if key is not None and response.get("result"):
+            new_template = make_sql_template(response["query"], budget)
+            if new_template is not None:
+                store_sql_template(key, new_template)
+        return response
+
+    @staticmethod
+    def _extract_selected(component: str, response: dict[str, Any]) -> dict[str, Any]:
+        """Достаёт из ответа SQL-агента поля выбранного компонента, нужные следующим этапам."""
+        raw_result = response.get("result", [])
+        if isinstance(raw_result, str):
+            try:
+                result_data = json.loads(raw_result)
+            except Exception as e:
+                print(f"Ошибка при обработке JSON для компонента {component}: {e}")
                 result_data = []
+        elif isinstance(raw_result, list):
+            result_data = raw_result
+        else:
+            result_data = []
 
-            selected = result_data[0] if result_data else {}
+        selected = result_data[0] if result_data else {}
 
-            if component == "cpu":
-                comp_info = {"socket": selected.get("socket")}
-            elif component == "motherboard":
-                comp_info = {
-                    "memory_slots": selected.get("memory_slots"),
-                    "max_memory": selected.get("max_memory"),
-                    "form_factor": selected.get("form_factor"),
-                }
-            else:
-                comp_info = selected
+        if component == "cpu":
+            return {"socket": selected.get("socket")}
+        if component == "motherboard":
+            return {
+                "memory_slots": selected.get("memory_slots"),
+                "max_memory": selected.get("max_memory"),
+                "form_factor": selected.get("form_factor"),
+            }
+        return selected
 
-            self.selected_components[component] = comp_info
+    def build_prompts(self, user_request: dict[str, Any]) -> tuple[dict[str, str], dict[str, Any]]:
+        """
+        Для каждого компонента (из списка распределённых по бюджету) формируется промпт.
 
-        return prompts, components
+        Компоненты подбираются этапами BUILD_STAGES: внутри этапа запросы к LLM и базе
+        выполняются параллельно, а промпты следующего этапа строятся уже с учётом
+        выбранных на предыдущих этапах компонентов.
+        """
+        prompts = {}
+        components = {}
+        req_components = user_request.get("components", {})
+        agent = get_sql_agent()
+
+        with ThreadPoolExecutor(max_workers=MAX_PARALLEL_COMPONENTS) as executor:
+            for stage in BUILD_STAGES:
+                stage_components = [c for c in stage if c in req_components]
+
+                # Промпты строим в текущем потоке: они читают selected_components
+                futures = {}
+                for component in stage_components:
+                    prompt = self._render_prompt(component, req_components[component])
+                    prompts[component] = prompt
+                    print(prompt)
+                    futures[component] = executor.submit(
+                        self._select_sql, agent, component, prompt, req_components[component]
+                    )
+
+                for component, future in futures.items():
+                    response = future.result()
+                    components[component] = response.get("result")
+                    self._select_component(component, self._extract_selected(component, response))
+
+        # Возвращаем компоненты в привычном порядке сборки
+        return (
+            {c: prompts[c] for c in self.component_order if c in prompts},
+            {c: components[c] for c in self.component_order if c in components},
+        )
 
 
 @tool
@@ -575,9 +1050,7 @@ def pc_builder_tool(user_input: str) -> dict[str, Any]:
     except ValidationError as e:
         return {"error": e.errors()}
 
-    component_budgets = calculate_component_budgets(
-        build_req.budget, build_req.build_type, components_percentages
-    )
+    component_budgets = dict(get_component_budgets(build_req.budget, build_req.build_type))
 
     components = {}
     for comp, comp_budget in component_budgets.items():
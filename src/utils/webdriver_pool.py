@@ -0,0 +1,103 @@
+"""
+Пул headless-драйверов Chrome, переиспользуемых между вызовами инструментов.
+"""
+import atexit
+import queue
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.chrome.options import Options
+
+# Сколько простаивающих браузеров держим открытыми одновременно
+POOL_SIZE = 2
+# После стольких запросов драйвер закрывается и создаётся заново
+MAX_USES = 100
+# Таймаут ожидания элементов (секунды) для WebDriverWait в инструментах
+WAIT_TIMEOUT = 10
+# Запросы, которые блокируются через CDP: аналитика, реклама, шрифты, картинки и видео
+BLOCKED_URLS = [
+    "*google-analytics*",
+    "*googletagmanager*",
+    "*doubleclick*",
+    "*mc.yandex*",
+    "*.woff",
+    "*.woff2",
+    "*.ttf",
+    "*.png",
+    "*.jpg",
+    "*.jpeg",
+    "*.gif",
+    "*.webp",
+    "*.svg",
+    "*.mp4",
+    "*.webm",
+]
+
+_idle_drivers: queue.LifoQueue[tuple[webdriver.Chrome, int]] = queue.LifoQueue(maxsize=POOL_SIZE)
+
+
+def create_chrome_driver() -> webdriver.Chrome:
+    """Создаёт новый headless-драйвер Chrome."""
+    chrome_options = Options()
+    chrome_options.add_argument("--headless")
+    chrome_options.add_argument("--disable-gpu")
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    # driver.get возвращается по DOMContentLoaded, не дожидаясь картинок и прочих ресурсов
+    chrome_options.page_load_strategy = "eager"
+    # Картинки парсерам не нужны
+    chrome_options.add_experimental_option(
+        "prefs", {"profile.managed_default_content_settings.images": 2}
+    )
+    driver = webdriver.Chrome(options=chrome_options)
+    # Блокировка действует на всё время жизни драйвера, в том числе после возврата в пул
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URLS})
+    return driver
+
+
+def _release_driver(driver: webdriver.Chrome, uses: int) -> None:
+    """Возвращает драйвер в пул, либо закрывает его, если пул полон или драйвер исчерпан."""
+    if uses < MAX_USES:
+        try:
+            driver.delete_all_cookies()
+            driver.get("about:blank")
+            _idle_drivers.put_nowait((driver, uses))
+            return
+        except (queue.Full, WebDriverException):
+            pass
+    driver.quit()
+
+
+@contextmanager
+def borrow_driver() -> Iterator[webdriver.Chrome]:
+    """
+    Выдаёт драйвер из пула (или создаёт новый) на время блока `with`.
+
+    Если внутри блока возникло исключение, драйвер закрывается, а не возвращается в пул,
+    чтобы следующий вызов не получил браузер в неизвестном состоянии.
+    """
+    try:
+        driver, uses = _idle_drivers.get_nowait()
+    except queue.Empty:
+        driver, uses = create_chrome_driver(), 0
+
+    try:
+        yield driver
+    except BaseException:
+        driver.quit()
+        raise
+    _release_driver(driver, uses + 1)
+
+
+@atexit.register
+def close_all_drivers() -> None:
+    """Закрывает все простаивающие браузеры при завершении процесса."""
+    while True:
+        try:
+            driver, _ = _idle_drivers.get_nowait()
+        except queue.Empty:
+            return
+        driver.quit()
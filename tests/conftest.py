@@ -2,14 +2,10 @@
 Конфигурационный файл для pytest с общими фикстурами.
 """
 
-import sys
-from pathlib import Path
-
 import pytest
 
-# Добавляем корневую директорию проекта в PYTHONPATH для импорта модулей
-PROJECT_ROOT = Path(__file__).parent.parent
-sys.path.insert(0, str(PROJECT_ROOT))
+# Корневая директория проекта добавляется в sys.path через pythonpath
+# в [tool.pytest.ini_options] (pyproject.toml)
 
 
 @pytest.fixture
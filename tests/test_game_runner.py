@@ -0,0 +1,46 @@
+"""
+Тесты проверки входных данных game_run_tool, работающие без браузера.
+"""
+
+import pytest
+
+pytest.importorskip("selenium")
+game_runner = pytest.importorskip("src.tools.game_runner")
+
+BASE_INPUT = {"game_name": "Cyberpunk 2077", "cpu": "Ryzen 5 5600", "gpu": "RTX 3060"}
+
+
+@pytest.mark.parametrize(
+    ("ram", "expected"),
+    [(16, 16), ("16", 16), (" 16 ", 16), (16.0, 16), (None, None)],
+)
+def test_validate_input_data_ram(ram, expected):
+    """ram приводится к int из целого числа, строки с числом и целого float."""
+    assert game_runner.validate_input_data({**BASE_INPUT, "ram": ram})["ram"] == expected
+
+
+def test_validate_input_data_without_ram():
+    """Без ram и memory объём памяти не задан."""
+    assert game_runner.validate_input_data(BASE_INPUT) == {**BASE_INPUT, "ram": None}
+
+
+def test_validate_input_data_memory_takes_precedence():
+    """memory, как синоним ram, имеет приоритет над ram."""
+    validated = game_runner.validate_input_data({**BASE_INPUT, "memory": 32, "ram": 16})
+    assert validated["ram"] == 32
+    assert game_runner.validate_input_data({**BASE_INPUT, "memory": None, "ram": 16})["ram"] is None
+
+
+@pytest.mark.parametrize("ram", [16.5, True, False, "16 ГБ", [16]])
+def test_validate_input_data_rejects_invalid_ram(ram):
+    """bool, дробные значения и строки не из одного числа отклоняются."""
+    with pytest.raises(ValueError, match="ram"):
+        game_runner.validate_input_data({**BASE_INPUT, "ram": ram})
+
+
+def test_validate_input_data_requires_fields():
+    """game_name, cpu и gpu обязательны и должны быть строками или None."""
+    with pytest.raises(ValueError, match="gpu: field required"):
+        game_runner.validate_input_data({"game_name": "Doom", "cpu": None})
+    with pytest.raises(ValueError, match="cpu: expected a string"):
+        game_runner.validate_input_data({**BASE_INPUT, "cpu": 5600})
@@ -0,0 +1,169 @@
+"""
+Тесты разбора выдачи regard.ru, работающие без сети и браузера.
+"""
+
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("bs4")
+httpx = pytest.importorskip("httpx")
+pytest.importorskip("playwright")
+regard_parser = pytest.importorskip("src.tools.regard_parser")
+
+SEARCH_HTML = (Path(__file__).parent / "fixtures" / "regard_search.html").read_text(
+    encoding="utf-8"
+)
+
+
+@pytest.mark.parametrize(
+    ("text", "expected"),
+    [
+        ("12\xa0490\xa0₽", 12490.0),
+        ("41 990 ₽", 41990.0),
+        ("990₽", 990.0),
+        ("", None),
+        (None, None),
+        ("Нет в наличии", None),
+    ],
+)
+def test_parse_price(text, expected):
+    """Цена читается с неразрывными и обычными пробелами между разрядами."""
+    assert regard_parser.parse_price(text) == expected
+
+
+def test_parse_products_html():
+    """Карточки разбираются в порядке выдачи; карточка без цены остаётся без цены."""
+    assert regard_parser.parse_products_html(SEARCH_HTML) == [
+        {
+            "name": "Процессор AMD Ryzen 5 5600",
+            "price": 12490.0,
+            "link": "https://www.regard.ru/product/1/cpu-a",
+        },
+        {
+            "name": "Процессор AMD Ryzen 7 7800X3D",
+            "price": 41990.0,
+            "link": "https://www.regard.ru/product/2/cpu-b",
+        },
+        {
+            "name": "Процессор Intel Core i3-12100F",
+            "price": None,
+            "link": "https://www.regard.ru/product/3/cpu-c",
+        },
+    ]
+
+
+def test_parse_products_html_without_cards():
+    """Страница без карточек (выдача отрисовывается на клиенте) даёт пустой список."""
+    assert regard_parser.parse_products_html("<html><body><div id='app'></div></body></html>") == []
+
+
+def test_select_products():
+    """Самый дешёвый и самый дорогой выбираются среди товаров с ценой, популярный — первый."""
+    selected = regard_parser.select_products(regard_parser.parse_products_html(SEARCH_HTML))
+    assert [(item["sort_type"], item["name"]) for item in selected] == [
+        ("Сначала с низкой ценой", "Процессор AMD Ryzen 5 5600"),
+        ("Сначала дорогие", "Процессор AMD Ryzen 7 7800X3D"),
+        ("Сначала популярные", "Процессор AMD Ryzen 5 5600"),
+    ]
+
+
+def test_select_products_without_prices():
+    """Без цен остаётся только популярный товар с пометкой об отсутствии цены."""
+    products = [{"name": "Корпус", "price": None, "link": "#"}]
+    assert regard_parser.select_products(products) == [
+        {
+            "sort_type": "Сначала популярные",
+            "name": "Корпус",
+            "price": "Цена не найдена",
+            "link": "#",
+        }
+    ]
+    assert regard_parser.select_products([]) == []
+
+
+class BrowserRequestedError(Exception):
+    """Сигнализирует, что парсер перешёл к запуску браузера."""
+
+
+def test_empty_http_result_falls_through_to_browser(monkeypatch):
+    """Если по HTTP карточек нет, компонент передаётся в Playwright."""
+    client = httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda request: httpx.Response(200, text="<html></html>"))
+    )
+    monkeypatch.setattr(regard_parser, "get_http_client", lambda: client)
+    monkeypatch.setattr(regard_parser, "_search_cache", regard_parser.OrderedDict())
+
+    def fake_playwright():
+        raise BrowserRequestedError
+
+    monkeypatch.setattr(regard_parser, "async_playwright", fake_playwright)
+
+    with pytest.raises(BrowserRequestedError):
+        asyncio.run(regard_parser.parse_components([regard_parser.CPU(cpu="Ryzen 5 5600")]))
+
+
+def test_http_result_skips_browser(monkeypatch):
+    """Выдача, полученная по HTTP, не требует браузера и попадает в кэш."""
+    client = httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda request: httpx.Response(200, text=SEARCH_HTML))
+    )
+    monkeypatch.setattr(regard_parser, "get_http_client", lambda: client)
+    monkeypatch.setattr(regard_parser, "_search_cache", regard_parser.OrderedDict())
+
+    def fake_playwright():
+        raise BrowserRequestedError
+
+    monkeypatch.setattr(regard_parser, "async_playwright", fake_playwright)
+
+    results = asyncio.run(regard_parser.parse_components([regard_parser.CPU(cpu="Ryzen 5 5600")]))
+    assert len(results["Ryzen 5 5600"]) == 3
+    assert regard_parser.get_cached_search("Ryzen 5 5600") == results["Ryzen 5 5600"]
+
+
+def test_save_storage_state_replaces_file(tmp_path, monkeypatch):
+    """Состояние браузера записывается целиком, временные файлы не остаются."""
+    state_path = tmp_path / "regard_state.json"
+    state_path.write_text("{broken", encoding="utf-8")
+    monkeypatch.setattr(regard_parser, "STORAGE_STATE_PATH", str(state_path))
+
+    state = {"cookies": [{"name": "session", "value": "1"}], "origins": []}
+    regard_parser.save_storage_state(state)
+
+    assert json.loads(state_path.read_text(encoding="utf-8")) == state
+    assert [path.name for path in tmp_path.iterdir()] == ["regard_state.json"]
+
+
+class FakeBrowser:
+    """Браузер, который, как Playwright, не может создать контекст из повреждённого файла."""
+
+    def __init__(self):
+        self.calls = []
+
+    async def new_context(self, **kwargs):
+        self.calls.append(kwargs)
+        if "storage_state" in kwargs:
+            raise ValueError("Unexpected token in JSON")
+        return "context"
+
+
+def test_new_browser_context_ignores_broken_state(tmp_path, monkeypatch):
+    """Повреждённый файл состояния не мешает запуску: создаётся чистый контекст."""
+    state_path = tmp_path / "regard_state.json"
+    state_path.write_text("{broken", encoding="utf-8")
+    monkeypatch.setattr(regard_parser, "STORAGE_STATE_PATH", str(state_path))
+
+    browser = FakeBrowser()
+    assert asyncio.run(regard_parser.new_browser_context(browser)) == "context"
+    assert browser.calls == [{"storage_state": str(state_path)}, {}]
+
+
+def test_new_browser_context_without_state(tmp_path, monkeypatch):
+    """Без сохранённого состояния контекст создаётся сразу чистым."""
+    monkeypatch.setattr(regard_parser, "STORAGE_STATE_PATH", str(tmp_path / "missing.json"))
+
+    browser = FakeBrowser()
+    assert asyncio.run(regard_parser.new_browser_context(browser)) == "context"
+    assert browser.calls == [{}]
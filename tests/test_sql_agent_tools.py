@@ -0,0 +1,304 @@
+"""
+Тесты вспомогательных функций SQL-агента, работающих без обращения к LLM.
+"""
+
+import json
+import os
+import sqlite3
+
+import pytest
+
+pytest.importorskip("langchain_community")
+# Модуль создаёт клиент ChatOpenAI при импорте; запросы к API в этих тестах не выполняются
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+sql_agent_tools = pytest.importorskip("src.tools.sql_agent_tools")
+
+
+@pytest.mark.parametrize(
+    ("text", "expected"),
+    [
+        ("игровой пк за 150к", 150000),
+        ("офисный компьютер до 80 тыс", 80000),
+        ("игровой пк за 120 000 рублей", 120000),
+        ("сборка за 95000", 95000),
+    ],
+)
+def test_extract_budget(text, expected):
+    """Бюджет распознаётся с множителем "к"/"тыс" и с пробелами между разрядами."""
+    assert sql_agent_tools.extract_budget(text) == expected
+
+
+@pytest.mark.parametrize("text", ["игровой пк за 1.5 млн", "игровой пк за 1,5 млн"])
+def test_extract_budget_rejects_fractional_millions(text):
+    """Дробная сумма в миллионах не разбирается как бюджет из её частей."""
+    assert sql_agent_tools.extract_budget(text) is None
+
+
+def test_extract_budget_out_of_range():
+    """Числа вне допустимого диапазона бюджета пропускаются."""
+    assert sql_agent_tools.extract_budget("игровой пк на 2 года") is None
+    assert sql_agent_tools.extract_budget("игровой пк за 150 компьютеров") is None
+    assert sql_agent_tools.extract_budget("игровой пк за 50 000 000") is None
+
+
+@pytest.mark.parametrize(
+    ("text", "expected"),
+    [
+        ("Игровой ПК за 150к", (150000, "игровая")),
+        ("Компьютер для офиса до 80 тыс", (80000, "офисная")),
+        ("ПК для стримов за 120 000", (120000, "игровая")),
+        ("Компьютер для офиса до 80 тысяч рублей", (80000, "офисная")),
+        ("Собери мне игровой ПК не дороже 120 000 руб.", (120000, "игровая")),
+    ],
+)
+def test_parse_simple_request(text, expected):
+    """Запрос только с бюджетом и типом сборки разбирается без LLM."""
+    assert sql_agent_tools.parse_simple_request(text) == expected
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "Игровой ПК за 150к с RTX 4070",
+        "Игровой ПК за 150к на Ryzen 7",
+        "Офисный ПК до 80 тыс, 32 гб памяти",
+        "Игровой ПК за 200к, корпус ATX",
+        "Офисный ПК до 60 тыс и блок питания 500W",
+        "игровой пк за 150к с ртх 4070",
+        "игровой пк за 150к на интеле",
+        "игровой пк за 150к, амд",
+        "игровой пк за 150к, радеон",
+        "игровой пк за 150к, нужна нвидиа",
+        "игровой пк за 150к с 4070 ti",
+        "игровой пк за 150к с 32 гигами",
+        "офисный пк за 150к с ссд",
+        "игровой пк с 4070 за 150к",
+    ],
+)
+def test_parse_simple_request_with_components_falls_back_to_llm(text):
+    """Запросы с конкретными компонентами отдаются LLM."""
+    assert sql_agent_tools.parse_simple_request(text) is None
+
+
+@pytest.mark.parametrize("text", ["Игровой ПК за 1.5 млн", "Хочу компьютер за 150к", "Игровой ПК"])
+def test_parse_simple_request_without_budget_or_type(text):
+    """Без распознанного бюджета или типа сборки запрос тоже отдаётся LLM."""
+    assert sql_agent_tools.parse_simple_request(text) is None
+
+
+PARSED_REQUEST = {"budget": 150000, "build_type": "игровая", "additional_info": {"gpu": "RTX 4070"}}
+
+
+@pytest.mark.parametrize(
+    "raw_content",
+    [
+        json.dumps(PARSED_REQUEST, ensure_ascii=False),
+        "```json\n" + json.dumps(PARSED_REQUEST, ensure_ascii=False) + "\n```",
+        "```\n" + json.dumps(PARSED_REQUEST, ensure_ascii=False) + "\n```",
+        "Вот результат разбора:\n" + json.dumps(PARSED_REQUEST, ensure_ascii=False) + "\nГотово.",
+    ],
+)
+def test_extract_json_object(raw_content):
+    """JSON достаётся из ответа как есть, из блока кода и из окружающего текста."""
+    assert sql_agent_tools.extract_json_object(raw_content) == PARSED_REQUEST
+
+
+@pytest.mark.parametrize("raw_content", ["Не удалось разобрать запрос", "{budget: 150000}"])
+def test_extract_json_object_reraises_original_error(raw_content):
+    """Если JSON не найден, выбрасывается ошибка разбора исходного ответа целиком."""
+    with pytest.raises(json.JSONDecodeError) as exc_info:
+        sql_agent_tools.extract_json_object(raw_content)
+    assert exc_info.value.doc == raw_content
+
+
+@pytest.mark.parametrize(
+    ("build_type", "expected"),
+    [
+        ("Игровой ПК", "игровая"),
+        ("игровая", "игровая"),
+        ("Офисная", "офисная"),
+        ("ПК для стримов", "игровая"),
+        ("для работы с документами", "офисная"),
+    ],
+)
+def test_parsed_build_request_normalizes_build_type(build_type, expected):
+    """Тип сборки из ответа LLM приводится к допустимому значению до проверки Literal."""
+    request = sql_agent_tools.ParsedBuildRequest(budget=150000, build_type=build_type)
+    assert request.build_type == expected
+
+
+@pytest.mark.parametrize(
+    ("query", "expected"),
+    [
+        ("SELECT * FROM cpu_merged", "SELECT * FROM cpu_merged LIMIT 1"),
+        ("SELECT * FROM cpu_merged;", "SELECT * FROM cpu_merged LIMIT 1"),
+        ("SELECT * FROM cpu_merged LIMIT 5;", "SELECT * FROM cpu_merged LIMIT 5;"),
+        ("SELECT 1 LIMIT 3 OFFSET 2", "SELECT 1 LIMIT 3 OFFSET 2"),
+        (
+            "SELECT * FROM (SELECT * FROM memory LIMIT 2) AS m",
+            "SELECT * FROM (SELECT * FROM memory LIMIT 2) AS m LIMIT 1",
+        ),
+    ],
+)
+def test_ensure_limit(query, expected):
+    """LIMIT добавляется, только если его нет в конце внешнего запроса."""
+    assert sql_agent_tools.ensure_limit(query, 1) == expected
+
+
+@pytest.mark.parametrize(
+    ("query", "expected"),
+    [
+        ("SELECT * FROM memory; -- note", "SELECT * FROM memory LIMIT 1"),
+        ("SELECT * FROM memory LIMIT 5 -- note", "SELECT * FROM memory LIMIT 5"),
+        ("SELECT * FROM memory /* a */ -- b", "SELECT * FROM memory LIMIT 1"),
+        (
+            "SELECT * FROM memory WHERE name = 'a -- b'",
+            "SELECT * FROM memory WHERE name = 'a -- b' LIMIT 1",
+        ),
+    ],
+)
+def test_ensure_limit_trailing_comments(query, expected):
+    """LIMIT не попадает внутрь комментария в конце запроса, строки не обрезаются."""
+    assert sql_agent_tools.ensure_limit(query, 1) == expected
+
+
+@pytest.mark.parametrize(
+    ("query", "expected"),
+    [
+        (
+            "SELECT * FROM cpu_merged WHERE price <= 45000 ORDER BY rating DESC LIMIT 1",
+            "SELECT * FROM cpu_merged WHERE price <= :budget ORDER BY rating DESC LIMIT 1",
+        ),
+        (
+            "SELECT * FROM memory WHERE price <= 45000 AND speed_num > 45000.5",
+            "SELECT * FROM memory WHERE price <= :budget AND speed_num > 45000.5",
+        ),
+        (
+            "SELECT * FROM memory WHERE price <= 45000 AND name = '45000'",
+            "SELECT * FROM memory WHERE price <= :budget AND name = '45000'",
+        ),
+    ],
+)
+def test_make_sql_template(query, expected):
+    """Литерал бюджета заменяется параметром; дробные числа и строки не трогаются."""
+    assert sql_agent_tools.make_sql_template(query, 45000) == expected
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "SELECT * FROM memory WHERE price <= 45000 OR average_price <= 45000",
+        "SELECT * FROM memory WHERE price <= 30000",
+        "SELECT * FROM memory WHERE name = '45000'",
+        "SELECT * FROM memory WHERE price <= 145000",
+    ],
+)
+def test_make_sql_template_requires_single_occurrence(query):
+    """Шаблон не строится, если бюджет встречается в запросе не ровно один раз."""
+    assert sql_agent_tools.make_sql_template(query, 45000) is None
+
+
+class FakeSQLAgent:
+    """SQL-агент, у которого LLM заменена готовым запросом, а база — SQLite в памяти."""
+
+    table_info = ""
+
+    def __init__(self, llm_query: str):
+        self.llm_query = llm_query
+        self.llm_calls = 0
+        self.connection = sqlite3.connect(":memory:")
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(
+            "CREATE TABLE cpu_merged (name TEXT, price INTEGER);"
+            "INSERT INTO cpu_merged VALUES ('Ryzen 5', 30000), ('Ryzen 7', 50000);"
+        )
+
+    def query_to_json(self, query, params=None):
+        return [dict(row) for row in self.connection.execute(query, params or {})]
+
+    def run(self, request, max_rows=None):
+        self.llm_calls += 1
+        budget = request.question.split("<= ")[1].split()[0]
+        query = self.llm_query.format(budget=budget)
+        return {"question": request.question, "query": query, "result": self.query_to_json(query)}
+
+
+@pytest.fixture
+def sql_template_cache():
+    sql_agent_tools._sql_template_cache.clear()
+    yield sql_agent_tools._sql_template_cache
+    sql_agent_tools._sql_template_cache.clear()
+
+
+def select_cpu(prompter, agent, budget):
+    params = {"budget": budget}
+    prompt = prompter._render_prompt("cpu", params)
+    return prompter._select_sql(agent, "cpu", prompt, params)
+
+
+def test_select_sql_reuses_template_with_new_budget(sql_template_cache):
+    """Повторная сборка с другим бюджетом выполняет сохранённый шаблон без LLM."""
+    agent = FakeSQLAgent(
+        "SELECT name FROM cpu_merged WHERE price <= {budget} ORDER BY price DESC LIMIT 1"
+    )
+    prompter = sql_agent_tools.DynamicPCBuilderPrompter()
+
+    assert select_cpu(prompter, agent, 40000)["result"] == [{"name": "Ryzen 5"}]
+    assert agent.llm_calls == 1
+    assert len(sql_template_cache) == 1
+
+    response = select_cpu(prompter, agent, 60000)
+    assert response["result"] == [{"name": "Ryzen 7"}]
+    assert ":budget" in response["query"]
+    assert agent.llm_calls == 1
+
+
+def test_select_sql_falls_back_to_llm_when_template_is_empty(sql_template_cache):
+    """Если шаблон не вернул строк, запрос генерируется LLM заново."""
+    agent = FakeSQLAgent(
+        "SELECT name FROM cpu_merged WHERE price <= {budget} ORDER BY price DESC LIMIT 1"
+    )
+    prompter = sql_agent_tools.DynamicPCBuilderPrompter()
+
+    select_cpu(prompter, agent, 40000)
+    response = select_cpu(prompter, agent, 20000)
+    assert response["result"] == []
+    assert response["query"] == (
+        "SELECT name FROM cpu_merged WHERE price <= 20000 ORDER BY price DESC LIMIT 1"
+    )
+    assert agent.llm_calls == 2
+
+
+def test_select_sql_skips_ambiguous_template(sql_template_cache):
+    """Запрос, где бюджет встречается дважды, не сохраняется как шаблон."""
+    agent = FakeSQLAgent(
+        "SELECT name FROM cpu_merged WHERE price <= {budget} AND price * 2 > {budget} LIMIT 1"
+    )
+    prompter = sql_agent_tools.DynamicPCBuilderPrompter()
+
+    select_cpu(prompter, agent, 40000)
+    select_cpu(prompter, agent, 60000)
+    assert not sql_template_cache
+    assert agent.llm_calls == 2
+
+
+@pytest.mark.parametrize("budget", [150000, 99999, 123457])
+@pytest.mark.parametrize("build_type", ["игровая", "офисная"])
+def test_get_component_budgets_sums_to_budget(budget, build_type):
+    """Распределение бюджета по компонентам в сумме даёт весь бюджет."""
+    budgets = dict(sql_agent_tools.get_component_budgets(budget, build_type))
+    assert set(budgets) == set(sql_agent_tools.components_percentages[build_type])
+    assert sum(budgets.values()) == budget
+
+
+def test_get_component_budgets_shares():
+    """Доли считаются целочисленно, остаток достаётся последнему компоненту."""
+    assert dict(sql_agent_tools.get_component_budgets(150000, "игровая")) == {
+        "gpu": 60000,
+        "cpu": 45000,
+        "memory": 15000,
+        "motherboard": 15000,
+        "power_supply": 7500,
+        "corpus": 7500,
+    }
+    assert dict(sql_agent_tools.get_component_budgets(99999, "офисная"))["power_supply"] == 10002